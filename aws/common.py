@@ -1,26 +1,589 @@
+import atexit
+import getpass
 import json
+import os
+import stat
+import sys
+import tempfile
+import threading
 
-from subprocess import run, PIPE
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import product, zip_longest
+from queue import Queue, Empty
+from subprocess import run, Popen, PIPE, CompletedProcess, TimeoutExpired
+from time import monotonic, sleep, time
+
+try:
+    import fcntl
+except ImportError:
+    FCNTL_AVAILABLE = False
+else:
+    FCNTL_AVAILABLE = True
+
+
+DEFAULT_MAX_WORKERS = 8
+
+# Requests per second allowed for each service, or for a single API as 'service.api'. Can be
+# overridden with a comma-separated list of 'key=rate' pairs in AWS_SCRIPTS_RATE_LIMITS. A rate
+# of 0 disables limiting for that key.
+DEFAULT_RATE_LIMITS = {
+    "ssm": 10,
+    "ssm.get-parameters": 40,
+    "ssm.put-parameter": 3,
+    "ecs": 20,
+    "ec2": 20,
+}
 
 
 class NonZeroErrorCode(Exception):
     pass
 
 
+class CommandTimeout(Exception):
+    pass
+
+
+class InsecureDirectory(Exception):
+    pass
+
+
+def check_private_directory(path):
+    """Raise 'InsecureDirectory' unless 'path' is a directory only the current user can access."""
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or \
+            status.st_mode & 0o077:
+        raise InsecureDirectory(
+            "{} must be a directory owned and only accessible by the current user".format(path)
+        )
+
+
+def make_private_directory(path):
+    """Create 'path' if it doesn't exist, accessible only by the current user.
+
+    Since a directory under a shared location like /tmp may have been created by someone else,
+    an existing directory must belong to the current user. Its permissions are tightened if
+    necessary.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.lstat(path)
+    if stat.S_ISDIR(status.st_mode) and status.st_uid == os.getuid() and \
+            status.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    check_private_directory(path)
+    return path
+
+
+def grouper(iterable, n, fillvalue=None):
+    """Collect data into fixed-length chunks or blocks"""
+    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
+    args = [iter(iterable)] * n
+    return zip_longest(*args, fillvalue=fillvalue)
+
+
+class Target:
+    """An AWS CLI profile and region to run commands against.
+
+    Either may be None, in which case the CLI's configured default is used.
+    """
+
+    default_label = "default"
+
+    def __init__(self, region=None, profile=None):
+        self.region = region
+        self.profile = profile
+
+    def __repr__(self):
+        return "Target(region={!r}, profile={!r})".format(self.region, self.profile)
+
+    @property
+    def cli_args(self):
+        args = []
+        if self.profile:
+            args += ["--profile", self.profile]
+        if self.region:
+            args += ["--region", self.region]
+        return args
+
+    @property
+    def labels(self):
+        return self.profile or self.default_label, self.region or self.default_label
+
+
+_context = threading.local()
+
+
+def current_target():
+    """Return the 'Target' commands on this thread are run against, if any."""
+    return getattr(_context, "target", None)
+
+
+@contextmanager
+def use_target(target):
+    """Run commands on this thread against 'target' within the context."""
+    previous = current_target()
+    _context.target = target
+    try:
+        yield target
+    finally:
+        _context.target = previous
+
+
+def get_targets(regions=None, profiles=None):
+    """Return a 'Target' for every combination of 'regions' and 'profiles'."""
+    return [
+        Target(region=region, profile=profile)
+        for profile, region in product(profiles or [None], regions or [None])
+    ]
+
+
+def add_target_arguments(parser):
+    """Add the '--regions' and '--profiles' arguments to an argument parser."""
+    parser.add_argument("--regions", nargs="+", metavar="REGION",
+                        help="Run against each of these regions in parallel")
+    parser.add_argument("--profiles", nargs="+", metavar="PROFILE",
+                        help="Run against each of these CLI profiles in parallel")
+
+
+def map_concurrently(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """Apply 'func' to each of 'items' using a pool of threads.
+
+    Results are returned in the same order as 'items'. Falls back to a simple loop when there's
+    nothing to gain from a pool. Worker threads run against the caller's current 'Target'.
+    """
+    items = list(items)
+    if len(items) <= 1 or max_workers <= 1:
+        return [func(item) for item in items]
+
+    target = current_target()
+
+    def run_against_target(item):
+        with use_target(target):
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run_against_target, items))
+
+
+def map_targets(func, targets, max_workers=DEFAULT_MAX_WORKERS):
+    """Call 'func' against each of 'targets' in parallel.
+
+    Returns a list of '(target, result, error)' tuples in the same order as 'targets'. A target
+    which raises an error doesn't prevent the others from completing.
+    """
+    def run_against_target(target):
+        with use_target(target):
+            try:
+                return target, func(), None
+            except Exception as error:
+                return target, None, error
+
+    return map_concurrently(run_against_target, targets, max_workers)
+
+
+class ResultCache:
+    """A thread-safe store of command output which expires after a per-command TTL.
+
+    Not used by default. Long-lived processes can install an instance as 'BaseCommand.cache' so
+    that repeated commands whose class sets 'cache_ttl' are answered from memory.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, args):
+        key = tuple(args)
+        with self._lock:
+            output, expires = self._entries.get(key, (None, 0))
+            if output is not None and expires > monotonic():
+                self.hits += 1
+                return output
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, args, output, ttl):
+        with self._lock:
+            self._entries[tuple(args)] = (output, monotonic() + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def get_state_directory():
+    """Return the directory holding rate limits and latencies shared between processes."""
+    return os.environ.get("AWS_SCRIPTS_RATE_LIMIT_DIR") or os.path.join(
+        tempfile.gettempdir(), "aws-scripts-rate-limits-{}".format(getpass.getuser())
+    )
+
+
+class RateLimiter:
+    """A token bucket per AWS service / API, shared by every process on the host.
+
+    Each bucket's state lives in a file under 'directory' which is locked while it's updated, so
+    concurrent invocations of the scripts collectively stay within the configured rates rather
+    than each being throttled and retrying. Buckets are kept separately for each 'Target'.
+    Limiting is skipped where file locking isn't available, and disabled with a warning if
+    'directory' can't be used.
+
+    A caller takes a token immediately, even if that leaves the bucket in debt, and then sleeps
+    until the debt would have been repaid. The lock is therefore only held for a read and write.
+    """
+
+    def __init__(self, rates=None, directory=None):
+        self.rates = DEFAULT_RATE_LIMITS if rates is None else rates
+        self.directory = directory or get_state_directory()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+        self._directory_ready = False
+
+    @classmethod
+    def from_environment(cls):
+        """Create a limiter configured by environment variables.
+
+        Malformed pairs in AWS_SCRIPTS_RATE_LIMITS are reported on stderr and otherwise ignored.
+        """
+        rates = dict(DEFAULT_RATE_LIMITS)
+        for pair in filter(None, os.environ.get("AWS_SCRIPTS_RATE_LIMITS", "").split(",")):
+            try:
+                key, rate = pair.split("=")
+                rates[key.strip()] = float(rate)
+            except ValueError:
+                print(
+                    "Ignoring '{}' in AWS_SCRIPTS_RATE_LIMITS. Expected 'key=rate'".format(pair),
+                    file=sys.stderr
+                )
+        return cls(rates, os.environ.get("AWS_SCRIPTS_RATE_LIMIT_DIR"))
+
+    def report(self):
+        """Write the time this process spent waiting on rate limits to stderr."""
+        print(
+            "Rate limited {} call(s), waiting {:.2f}s in total".format(
+                self.waits, self.wait_seconds
+            ),
+            file=sys.stderr
+        )
+
+    def get_key(self, service, api):
+        """Return the key of the bucket for 'service' / 'api'."""
+        api_key = "{}.{}".format(service, api)
+        return api_key if api_key in self.rates else service
+
+    def _get_bucket_path(self, key):
+        target = current_target()
+        if target is not None:
+            key = "{}.{}".format(key, ".".join(target.labels))
+        return os.path.join(self.directory, key)
+
+    def acquire(self, service, api):
+        """Take a token for 'service' / 'api', sleeping if necessary. Returns the time waited."""
+        key = self.get_key(service, api)
+        rate = self.rates.get(key, 0)
+        if not rate or not FCNTL_AVAILABLE:
+            return 0.0
+
+        if not self._directory_ready:
+            try:
+                make_private_directory(self.directory)
+            except (OSError, InsecureDirectory) as error:
+                print("Rate limiting disabled: {}".format(error), file=sys.stderr)
+                self.rates = {}
+                return 0.0
+            self._directory_ready = True
+        with open(self._get_bucket_path(key), "a+") as bucket_file:
+            fcntl.flock(bucket_file, fcntl.LOCK_EX)
+            bucket_file.seek(0)
+            try:
+                state = json.loads(bucket_file.read())
+            except ValueError:
+                state = {"tokens": rate, "updated": time(), "calls": 0, "wait_seconds": 0.0}
+
+            now = time()
+            tokens = min(rate, state["tokens"] + (now - state["updated"]) * rate) - 1
+            wait = max(0.0, -tokens / rate)
+            state.update({
+                "tokens": tokens,
+                "updated": now,
+                "calls": state["calls"] + 1,
+                "wait_seconds": state["wait_seconds"] + wait,
+            })
+
+            bucket_file.seek(0)
+            bucket_file.truncate()
+            bucket_file.write(json.dumps(state))
+
+        if wait:
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += wait
+            sleep(wait)
+        return wait
+
+    def stats(self):
+        """Return the calls made and seconds waited for each bucket, across all processes."""
+        stats = {}
+        try:
+            keys = sorted(os.listdir(self.directory))
+        except OSError:
+            keys = []
+        for key in keys:
+            try:
+                with open(os.path.join(self.directory, key)) as bucket_file:
+                    state = json.loads(bucket_file.read())
+            except (OSError, ValueError):
+                continue
+            stats[key] = {"calls": state["calls"], "wait_seconds": state["wait_seconds"]}
+        return stats
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the limiter shared by every command in this process, creating it on first use."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter.from_environment()
+            if os.environ.get("AWS_SCRIPTS_RATE_LIMIT_REPORT"):
+                atexit.register(_rate_limiter.report)
+        return _rate_limiter
+
+
+class CallPolicy:
+    """Timeouts, an overall deadline and hedging applied to every command.
+
+    'timeout' limits each command and 'deadline' limits all commands run after the policy is
+    created, both in seconds. Exceeding either raises 'CommandTimeout'.
+
+    If 'hedge' is set, read-only commands which haven't finished after 'hedge_after' seconds are
+    started a second time. Whichever process succeeds first is used and the other is killed. If
+    'hedge_after' isn't given, it's the 95th percentile of the latencies observed for that API,
+    or 'default_hedge_after' until enough latencies have been observed.
+
+    If 'directory' is given and 'hedge' is set, the latest latencies for each API are also kept
+    in a file under it which is locked while it's updated, so they're shared by every process on
+    the host. Otherwise they're only kept in memory. Failing to read or write that file is
+    ignored.
+    """
+
+    default_hedge_after = 2.0
+    min_samples = 10
+    max_samples = 200
+
+    def __init__(self, timeout=None, deadline=None, hedge=False, hedge_after=None,
+                 directory=None):
+        self.timeout = timeout
+        self.deadline = None if deadline is None else monotonic() + deadline
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.directory = directory if FCNTL_AVAILABLE else None
+        self._latencies = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._lock = threading.Lock()
+        self._directory_ready = False
+
+    @property
+    def is_default(self):
+        return self.timeout is None and self.deadline is None and not self.hedge
+
+    def get_timeout(self):
+        """Return the time the next command may take, or None if it's unlimited."""
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise CommandTimeout("Deadline exceeded")
+        return remaining if self.timeout is None else min(self.timeout, remaining)
+
+    def _get_latencies_path(self, key):
+        if not self._directory_ready:
+            make_private_directory(os.path.dirname(self.directory))
+            make_private_directory(self.directory)
+            self._directory_ready = True
+        return os.path.join(self.directory, ".".join(key))
+
+    def record(self, key, latency):
+        with self._lock:
+            self._latencies[key].append(latency)
+        if self.directory is None or key is None or not self.hedge:
+            return
+
+        try:
+            with open(self._get_latencies_path(key), "a+") as latencies_file:
+                fcntl.flock(latencies_file, fcntl.LOCK_EX)
+                latencies_file.seek(0)
+                try:
+                    latencies = json.loads(latencies_file.read())
+                except ValueError:
+                    latencies = []
+                latencies = [*latencies, latency][-self.max_samples:]
+                latencies_file.seek(0)
+                latencies_file.truncate()
+                latencies_file.write(json.dumps(latencies))
+        except (OSError, InsecureDirectory):
+            pass
+
+    def get_latencies(self, key):
+        """Return the latest latencies recorded for 'key', by any process sharing 'directory'."""
+        if self.directory is not None and key is not None:
+            try:
+                with open(self._get_latencies_path(key)) as latencies_file:
+                    fcntl.flock(latencies_file, fcntl.LOCK_SH)
+                    return json.loads(latencies_file.read())
+            except (OSError, ValueError, InsecureDirectory):
+                pass
+        with self._lock:
+            return list(self._latencies[key])
+
+    def get_hedge_after(self, key):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        latencies = sorted(self.get_latencies(key))
+        if len(latencies) < self.min_samples:
+            return self.default_hedge_after
+        return latencies[int(len(latencies) * 0.95)]
+
+
+call_policy = CallPolicy(directory=os.path.join(get_state_directory(), "latencies"))
+
+
+def add_call_policy_arguments(parser):
+    """Add arguments configuring the 'call_policy' to an argument parser."""
+    parser.add_argument("--timeout", type=float,
+                        help="Seconds each AWS call may take before giving up")
+    parser.add_argument("--deadline", type=float,
+                        help="Seconds all AWS calls may take in total before giving up")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Repeat slow read-only calls, using whichever finishes first")
+    parser.add_argument("--hedge-after", type=float,
+                        help="Seconds before repeating a call. Defaults to the observed p95")
+
+
+def configure_call_policy(args):
+    """Replace the 'call_policy' using parsed arguments from 'add_call_policy_arguments'."""
+    global call_policy
+    call_policy = CallPolicy(
+        args.timeout, args.deadline, args.hedge, args.hedge_after, call_policy.directory
+    )
+
+
 class BaseCommand:
 
     base_command = None
 
+    cache = None
+    cache_ttl = None
+
     @property
     def call_args(self):
         return self.base_command.split(" ")
 
+    @property
+    def api(self):
+        """Return the '(service, api)' the command calls, if it's an 'aws' command."""
+        program, *sub_commands = (self.base_command or "").split(" ")
+        if program == "aws" and len(sub_commands) >= 2:
+            return tuple(sub_commands[:2])
+        return None
+
+    @property
+    def read_only(self):
+        return self.api is not None and self.api[1].startswith(("list-", "describe-", "get-"))
+
+    def _wait_for_rate_limit(self):
+        if self.api is not None:
+            get_rate_limiter().acquire(*self.api)
+
+    def _run(self, args):
+        timeout = call_policy.get_timeout()
+        if call_policy.hedge and self.read_only:
+            return self._run_hedged(args, timeout)
+
+        kwargs = {} if timeout is None else {"timeout": timeout}
+        started = monotonic()
+        try:
+            completed_process = run(args, stdout=PIPE, **kwargs)
+        except TimeoutExpired:
+            raise CommandTimeout("{} timed out after {:.1f}s".format(self.base_command, timeout))
+        if completed_process.returncode == 0:
+            call_policy.record(self.api, monotonic() - started)
+        return completed_process
+
+    def _run_hedged(self, args, timeout):
+        """Run the command, starting a duplicate if it's slow and using whichever finishes first.
+
+        A failed process is only used once every process has finished.
+        """
+        started = monotonic()
+        finished = Queue()
+        processes = []
+
+        def start():
+            process = Popen(args, stdout=PIPE)
+            processes.append(process)
+            threading.Thread(
+                target=lambda: finished.put((process, process.communicate()[0])), daemon=True
+            ).start()
+
+        def wait(seconds):
+            if timeout is not None:
+                remaining = timeout - (monotonic() - started)
+                seconds = remaining if seconds is None else min(seconds, remaining)
+            return finished.get(timeout=max(seconds, 0)) if seconds is not None else finished.get()
+
+        start()
+        try:
+            try:
+                process, stdout = wait(call_policy.get_hedge_after(self.api))
+            except Empty:
+                if timeout is not None and monotonic() - started >= timeout:
+                    raise
+                self._wait_for_rate_limit()
+                start()
+                process, stdout = wait(None)
+            if process.returncode != 0 and len(processes) > 1:
+                process, stdout = wait(None)
+        except Empty:
+            raise CommandTimeout("{} timed out after {:.1f}s".format(self.base_command, timeout))
+        finally:
+            for other in processes:
+                if other.poll() is None:
+                    other.kill()
+
+        if process.returncode == 0:
+            call_policy.record(self.api, monotonic() - started)
+        return CompletedProcess(args, process.returncode, stdout)
+
     def __call__(self):
         """Run the command."""
-        completed_process = run(self.call_args, stdout=PIPE)
+        args = self.call_args
+        target = current_target()
+        if target is not None:
+            args = [*args, *target.cli_args]
+        cache = BaseCommand.cache if self.cache_ttl else None
+        if cache is not None:
+            output = cache.get(args)
+            if output is not None:
+                return json.loads(output)
+        self._wait_for_rate_limit()
+        completed_process = self._run(args)
         if completed_process.returncode != 0:
             raise NonZeroErrorCode(completed_process.returncode)
-        return json.loads(completed_process.stdout.decode())
+        output = completed_process.stdout.decode()
+        if cache is not None:
+            cache.set(args, output, self.cache_ttl)
+        return json.loads(output)
 
 
 class BasePaginatedCommand(BaseCommand):
@@ -55,6 +618,8 @@ class ListClusters(BasePaginatedCommand):
 
     base_command = "aws ecs list-clusters"
 
+    cache_ttl = 5 * 60
+
     results_key = "clusterArns"
 
 
@@ -62,6 +627,8 @@ class ListServices(BasePaginatedCommand):
 
     base_command = "aws ecs list-services"
 
+    cache_ttl = 5 * 60
+
     results_key = "serviceArns"
 
     def __init__(self, cluster_arn, **kwargs):
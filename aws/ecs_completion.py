@@ -0,0 +1,214 @@
+"""
+Shell completion of cluster and service names for get_ecs_url.
+
+Completions are answered from a local index of cluster and service ARNs, so no AWS calls are made
+while completing. The index is refreshed in the background whenever it's older than
+'--max-age' seconds. The index is kept separately for each AWS profile and region.
+
+Usage:
+
+    Add one of the following to your shell's rc file:
+
+        eval "$(python ecs_completion.py bash)"
+
+        eval "$(python ecs_completion.py zsh)"
+
+    'get_ecs_url' and 'get_ecs_url.py' commands will then complete cluster and service names.
+    Names beginning with the current word are offered first, followed by names containing it,
+    mirroring how get_ecs_url matches names.
+
+    The index can also be rebuilt in the foreground:
+
+        python ecs_completion.py refresh
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from subprocess import Popen, DEVNULL
+from time import time
+
+
+DEFAULT_MAX_AGE = 60 * 60
+
+# get_ecs_url's options which take a value, so aren't followed by a cluster or service name
+VALUE_OPTIONS = (
+    "--min-interval", "--max-interval", "--exec", "--control-persist", "--prefer-az",
+    "--az-source", "--timeout", "--deadline", "--hedge-after",
+)
+
+# Cluster and service names are completed for the first and second words which aren't options or
+# their values. Bash splits "--option=value" into three words, around the "="
+BASH_SCRIPT = """
+_get_ecs_url () {{
+    local cur=${{COMP_WORDS[COMP_CWORD]}}
+    local IFS=$'\\n'
+    local -a positional=()
+    local i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case ${{COMP_WORDS[i]}} in
+            {value_options})
+                ((i++))
+                [[ ${{COMP_WORDS[i]}} == "=" ]] && ((i++)) ;;
+            -*) ;;
+            *) positional+=("${{COMP_WORDS[i]}}") ;;
+        esac
+    done
+    # The current word is an option, or an option's value
+    [[ $i -gt $COMP_CWORD || $cur == -* ]] && return
+    case ${{#positional[@]}} in
+        0) COMPREPLY=($("{python}" "{script}" complete clusters "$cur")) ;;
+        1) COMPREPLY=($("{python}" "{script}" complete services "$cur" "${{positional[0]}}")) ;;
+    esac
+}}
+complete -F _get_ecs_url get_ecs_url get_ecs_url.py
+"""
+
+ZSH_SCRIPT = """
+_get_ecs_url () {{
+    local cur=$words[CURRENT]
+    local -a names positional
+    local i
+    for ((i = 2; i < CURRENT; i++)); do
+        case $words[i] in
+            ({value_options}) ((i++)) ;;
+            (-*) ;;
+            (*) positional+=("$words[i]") ;;
+        esac
+    done
+    [[ $i -gt $CURRENT || $cur == -* ]] && return
+    case $#positional in
+        0) names=(${{(f)"$("{python}" "{script}" complete clusters "$cur")"}}) ;;
+        1) names=(${{(f)"$("{python}" "{script}" complete services "$cur" "$positional[1]")"}}) ;;
+    esac
+    compadd -U -- $names
+}}
+compdef _get_ecs_url get_ecs_url get_ecs_url.py
+"""
+
+
+def get_completion_script(shell, python=sys.executable, script=os.path.abspath(__file__)):
+    """Return the completion script for 'shell', running 'script' with 'python' to complete."""
+    template = BASH_SCRIPT if shell == "bash" else ZSH_SCRIPT
+    return template.format(python=python, script=script, value_options="|".join(VALUE_OPTIONS))
+
+
+def get_index_path():
+    """Return the path of the index for the current AWS profile and region."""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    profile = os.environ.get("AWS_PROFILE", "default")
+    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION", "default")
+    filename = "ecs_names.{}.{}.json".format(profile, region)
+    return os.path.join(cache_dir, "aws-scripts", filename)
+
+
+def read_index(path):
+    try:
+        with open(path) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_index(path, clusters):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temporary_path, "w") as index_file:
+        json.dump({"updated": time(), "clusters": clusters}, index_file)
+    os.replace(temporary_path, path)
+
+
+def refresh_index(path):
+    """Rebuild the index from 'ListClusters' and 'ListServices' results."""
+    from list_ecs_services import get_services
+
+    clusters = {cluster_arn: services for cluster_arn, services, _ in get_services()}
+    write_index(path, clusters)
+
+
+def refresh_in_background(path):
+    """Start a detached process to refresh the index, unless one is already running."""
+    lock_path = path + ".lock"
+    try:
+        if time() - os.path.getmtime(lock_path) < 5 * 60:
+            return
+        os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL))
+    except OSError:
+        return
+    Popen(
+        [sys.executable, os.path.abspath(__file__), "refresh", "--lock", lock_path],
+        stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True,
+    )
+
+
+def match_names(word, arns):
+    """Return names of 'arns' beginning with 'word', followed by those otherwise containing it."""
+    from list_ecs_services import get_name_from_arn
+
+    names = [get_name_from_arn(arn) for arn in arns]
+    prefixed = [name for name in names if name.startswith(word)]
+    contained = [name for name in names if word in name and not name.startswith(word)]
+    return prefixed + contained
+
+
+def complete(index, kind, word, cluster_name=None):
+    clusters = index["clusters"]
+    if kind == "clusters":
+        return match_names(word, clusters)
+    cluster_arns = [arn for arn in clusters if cluster_name in arn]
+    if len(cluster_arns) != 1:
+        return []
+    return match_names(word, clusters[cluster_arns[0]])
+
+
+def main(kind, word, cluster_name=None, max_age=DEFAULT_MAX_AGE):
+    path = get_index_path()
+    index = read_index(path)
+    if index is None or time() - index.get("updated", 0) > max_age:
+        refresh_in_background(path)
+    if index is None:
+        return []
+    return complete(index, kind, word, cluster_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Complete cluster and service names for get_ecs_url"
+    )
+    subparsers = parser.add_subparsers(dest="subcommand")
+    subparsers.required = True
+
+    subparsers.add_parser("bash", help="Print the bash completion script")
+    subparsers.add_parser("zsh", help="Print the zsh completion script")
+
+    refresh_parser = subparsers.add_parser("refresh", help="Rebuild the name index")
+    refresh_parser.add_argument("--lock", help=argparse.SUPPRESS)
+
+    complete_parser = subparsers.add_parser("complete", help="Print matching names")
+    complete_parser.add_argument("kind", choices=["clusters", "services"])
+    complete_parser.add_argument("word", nargs="?", default="")
+    complete_parser.add_argument("cluster", nargs="?", default="")
+    complete_parser.add_argument("--max-age", default=DEFAULT_MAX_AGE, type=float,
+                                 help="Refresh the index in the background after this many "
+                                      "seconds")
+
+    args = parser.parse_args()
+
+    if args.subcommand in ("bash", "zsh"):
+        print(get_completion_script(args.subcommand))
+    elif args.subcommand == "refresh":
+        try:
+            refresh_index(get_index_path())
+        finally:
+            if args.lock:
+                os.remove(args.lock)
+    else:
+        for name in main(args.kind, args.word, args.cluster, args.max_age):
+            print(name)
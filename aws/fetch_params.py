@@ -7,20 +7,54 @@ Usage:
 
     Provide:
 
-        <name-prefix> - The string by which to filter parameters
+        <name-prefix> - The string by which to filter parameters. Several prefixes may be given.
 
     Returns an array containing the names, types and values of all parameters with names beginning
-    with 'name-prefix'.
+    with 'name-prefix'. Parameters matching more than one prefix are only fetched and returned
+    once.
+
+    OPTIONAL:
+
+        --partitions [<suffix> ...] - Split the prefix into sub-prefixes which are enumerated in
+                                      parallel. With no suffixes, the prefix is split on every
+                                      character permitted in a parameter name.
+
+        --max-workers <n>           - The number of partitions to enumerate at once.
+
+        --metadata-only             - Return the 'describe-parameters' records of matching
+                                      parameters without fetching or decrypting any values.
+
+        --group                     - Return an object mapping each prefix to its parameters
+                                      instead of a flat array.
+
+        --regions <region> ...      - Fetch parameters from each combination of region and CLI
+        --profiles <profile> ...      profile in parallel. Returns an array with one object per
+                                      combination, containing its 'Profile', 'Region' and either
+                                      'Parameters' or the 'Error' encountered.
 """
 
 
 import argparse
 import json
+import string
 import sys
+import threading
 
-from itertools import zip_longest
+from itertools import chain
 
-from common import BaseCommand, NonZeroErrorCode
+from common import (
+    BaseCommand,
+    CommandTimeout,
+    NonZeroErrorCode,
+    DEFAULT_MAX_WORKERS,
+    add_call_policy_arguments,
+    add_target_arguments,
+    configure_call_policy,
+    get_targets,
+    grouper,
+    map_concurrently,
+    map_targets,
+)
 
 
 class NoParametersFound(Exception):
@@ -31,36 +65,51 @@ class InvalidPathError(Exception):
     pass
 
 
-def grouper(iterable, n, fillvalue=None):
-    """Collect data into fixed-length chunks or blocks"""
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
-
-
 class DescribeParameters(BaseCommand):
-    """An object representing a single 'aws ssm describe-parameters' command."""
+    """An object representing a single 'aws ssm describe-parameters' command.
+
+    The CLI fetches every page itself unless a paging argument such as '--next-token' or
+    '--max-results' is given, in which case only a single page is returned. Pass 'single_page' to
+    fetch just the first page. With 'exact', only a parameter named exactly 'name_prefix' matches.
+    """
 
     base_command = "aws ssm describe-parameters"
 
+    cache_ttl = 60
+
     filters_arg = "--filters"
     filters_value = "Key=Name,Values={name_prefix}"
+    exact_filters_arg = "--parameter-filters"
+    exact_filters_value = "Key=Name,Option=Equals,Values={name_prefix}"
 
     next_arg = "--next-token"
+    max_results_arg = "--max-results"
+    page_size_arg = "--page-size"
+
+    page_size = 50
 
-    def __init__(self, name_prefix=None, next_token=None):
+    def __init__(self, name_prefix=None, next_token=None, single_page=False, exact=False):
         self.name_prefix = name_prefix
         self.next_token = next_token
+        self.single_page = single_page
+        self.exact = exact
 
     @property
     def call_args(self):
         args = self.base_command.split(" ")
-        if self.name_prefix:
+        if self.name_prefix and self.exact:
+            args.append(self.exact_filters_arg)
+            args.append(self.exact_filters_value.format(name_prefix=self.name_prefix))
+        elif self.name_prefix:
             args.append(self.filters_arg)
             args.append(self.filters_value.format(name_prefix=self.name_prefix))
         if self.next_token:
             args.append(self.next_arg)
             args.append(self.next_token)
+        if self.next_token or self.single_page:
+            args += [self.max_results_arg, str(self.page_size)]
+        else:
+            args += [self.page_size_arg, str(self.page_size)]
         return args
 
 
@@ -90,53 +139,308 @@ class GetParameters(BaseCommand):
         return args
 
 
+class Parameter:
+    """A single parameter whose value is fetched and decrypted the first time it's accessed.
+
+    Fetching is done for the whole '_ValueBatch' the parameter belongs to, so accessing the values
+    of neighbouring parameters costs no further calls.
+    """
+
+    __slots__ = ("name", "type", "version", "last_modified_date", "_value", "_batch")
+
+    def __init__(self, name, parameter_type, version=None, last_modified_date=None):
+        self.name = name
+        self.type = parameter_type
+        self.version = version
+        self.last_modified_date = last_modified_date
+        self._value = None
+        self._batch = None
+
+    def __repr__(self):
+        return "Parameter(name={!r}, type={!r}, version={!r})".format(
+            self.name, self.type, self.version
+        )
+
+    @classmethod
+    def from_description(cls, description):
+        """Create an instance from a 'describe-parameters' record."""
+        return cls(
+            name=description["Name"],
+            parameter_type=description.get("Type"),
+            version=description.get("Version"),
+            last_modified_date=description.get("LastModifiedDate"),
+        )
+
+    @property
+    def value(self):
+        if self._batch is not None:
+            self._batch.fetch()
+        return self._value
+
+    def to_dict(self):
+        """Return the parameter in the format of a 'get-parameters' result."""
+        return {"Name": self.name, "Type": self.type, "Value": self.value, "Version": self.version}
+
+
+class _ValueBatch:
+    """A group of parameters whose values are fetched with a single 'get-parameters' call.
+
+    Values may be accessed from several threads at once, but the batch is only fetched once.
+    """
+
+    __slots__ = ("parameters", "lock")
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.lock = threading.Lock()
+        for parameter in parameters:
+            parameter._batch = self
+
+    @property
+    def fetched(self):
+        return self.parameters[0]._batch is None
+
+    def fetch(self):
+        if self.fetched:
+            return
+        with self.lock:
+            if self.fetched:
+                return
+            results = GetParameters([parameter.name for parameter in self.parameters])()
+            values = {
+                result["Name"]: result.get("Value")
+                for result in results.get(CompileParameters.parameters_key)
+            }
+            # Every value is set before the batch is marked as fetched, so a thread which sees it
+            # fetched without taking the lock never reads a missing value
+            for parameter in self.parameters:
+                parameter._value = values.get(parameter.name)
+            for parameter in self.parameters:
+                parameter._batch = None
+
+
+class LazyParameters:
+    """A sequence of 'Parameter' objects whose values are fetched in batches on first access."""
+
+    __slots__ = ("_parameters", "max_workers")
+
+    def __init__(self, parameters, max_workers=DEFAULT_MAX_WORKERS):
+        self._parameters = parameters
+        self.max_workers = max_workers
+        for index in range(0, len(parameters), GetParameters.max_length):
+            _ValueBatch(parameters[index:index + GetParameters.max_length])
+
+    def __len__(self):
+        return len(self._parameters)
+
+    def __iter__(self):
+        return iter(self._parameters)
+
+    def __getitem__(self, index):
+        return self._parameters[index]
+
+    def fetch_all(self):
+        """Fetch every outstanding batch of values concurrently."""
+        batches = {
+            id(parameter._batch): parameter._batch
+            for parameter in self._parameters if parameter._batch is not None
+        }
+        map_concurrently(_ValueBatch.fetch, batches.values(), self.max_workers)
+
+    def to_list(self):
+        """Return every parameter in the format of 'get-parameters' results."""
+        self.fetch_all()
+        return [parameter.to_dict() for parameter in self._parameters]
+
+
+def collapse_prefixes(name_prefixes):
+    """Remove duplicate prefixes and those already covered by a shorter prefix."""
+    collapsed = []
+    for name_prefix in sorted(set(name_prefixes)):
+        if not any(name_prefix.startswith(shorter) for shorter in collapsed):
+            collapsed.append(name_prefix)
+    return collapsed
+
+
 class CompileParameters:
+    """Compile the names and values of all parameters beginning with any of 'name_prefixes'.
+
+    Names are discovered for each prefix separately, then merged and de-duplicated so that
+    parameters matching more than one prefix are only fetched once.
+
+    'describe-parameters' pages have to be fetched one after another, since each page depends on
+    the previous page's token. If 'partitions' is given, each prefix is instead split into
+    sub-prefixes (by appending each partition suffix) which are enumerated in parallel, turning
+    one long chain of pages into several short ones. A parameter named exactly the prefix matches
+    none of the sub-prefixes, so it's looked up separately. The first page for the full prefix is
+    always fetched on its own and partitioning is skipped if that page is the only one.
+
+    Partitions must cover every parameter of interest. Passing 'name_characters' partitions on
+    every character permitted in a parameter name, which does.
+    """
 
     parameters_key = "Parameters"
     next_token_key = "NextToken"
 
     parameter_name_key = "Name"
 
-    def __init__(self, name_prefix):
-        self.name_prefix = name_prefix
+    name_characters = string.ascii_letters + string.digits + "_.-/"
 
-    def _get_names(self):
+    def __init__(self, name_prefixes, partitions=None, max_workers=DEFAULT_MAX_WORKERS):
+        if isinstance(name_prefixes, str):
+            name_prefixes = [name_prefixes]
+        self.name_prefixes = list(dict.fromkeys(name_prefixes))
+        self.partitions = partitions
+        self.max_workers = max_workers
+
+    def _walk_pages(self, name_prefix, exact=False):
+        """Return the parameters from every 'describe-parameters' page for 'name_prefix'.
+
+        The CLI normally walks every page in one call. Any token it returns is followed too.
+        """
         parameters = []
-        first_page = DescribeParameters(self.name_prefix)()
-        parameters.extend(first_page.get(self.parameters_key, []))
-        next_token = first_page.get(self.next_token_key, None)
-        while next_token:
-            results = DescribeParameters(self.name_prefix, next_token)()
-            parameters.extend(results.get(self.parameters_key))
+        next_token = None
+        while True:
+            results = DescribeParameters(name_prefix, next_token, exact=exact)()
+            parameters.extend(results.get(self.parameters_key, []))
             next_token = results.get(self.next_token_key, None)
+            if not next_token:
+                return parameters
+
+    def _walk_partitions(self, name_prefix, first_page):
+        """Enumerate each partition of 'name_prefix', and the prefix itself, in parallel."""
+        queries = [(name_prefix + suffix, False) for suffix in dict.fromkeys(self.partitions)]
+        queries.append((name_prefix, True))
+        pages = map_concurrently(
+            lambda query: self._walk_pages(*query), queries, self.max_workers
+        )
+        return [*first_page.get(self.parameters_key, []), *chain(*pages)]
+
+    def _describe_prefix(self, name_prefix):
+        if not self.partitions:
+            return self._walk_pages(name_prefix)
+        first_page = DescribeParameters(name_prefix, single_page=True)()
+        if first_page.get(self.next_token_key, None):
+            return self._walk_partitions(name_prefix, first_page)
+        return first_page.get(self.parameters_key, [])
+
+    def _describe(self):
+        """Return the 'describe-parameters' records for every prefix, de-duplicated by name."""
+        name_prefixes = collapse_prefixes(self.name_prefixes)
+        pages = map_concurrently(self._describe_prefix, name_prefixes, self.max_workers)
+        parameters = {}
+        for parameter in chain(*pages):
+            parameters.setdefault(parameter.get(self.parameter_name_key), parameter)
         if not parameters:
-            msg = "No Parameters found for name prefix: {}".format(self.name_prefix)
+            msg = "No Parameters found for name prefix: {}".format(", ".join(self.name_prefixes))
             raise NoParametersFound(msg)
-        return [parameter.get(self.parameter_name_key) for parameter in parameters]
+        return list(parameters.values())
+
+    def _get_names(self):
+        return [parameter.get(self.parameter_name_key) for parameter in self._describe()]
 
     def _get_values(self, names):
-        parameters = []
-        for names_subset in grouper(names, GetParameters.max_length):
+        def get_subset(names_subset):
             results = GetParameters([name for name in names_subset if name])()
-            parameters.extend(results.get(self.parameters_key))
-        return parameters
+            return results.get(self.parameters_key)
+
+        subsets = grouper(names, GetParameters.max_length)
+        return [*chain(*map_concurrently(get_subset, subsets, self.max_workers))]
+
+    def group_by_prefix(self, parameters):
+        """Group 'parameters' by each of the requested prefixes their names begin with."""
+        return {
+            name_prefix: [
+                parameter for parameter in parameters
+                if parameter.get(self.parameter_name_key).startswith(name_prefix)
+            ]
+            for name_prefix in self.name_prefixes
+        }
+
+    def names(self):
+        """Return the names of matching parameters without fetching any values."""
+        return self._get_names()
+
+    def metadata(self):
+        """Return the metadata of matching parameters without fetching any values."""
+        return self._describe()
+
+    def lazy(self):
+        """Return matching parameters as 'LazyParameters', deferring fetching their values."""
+        return LazyParameters(
+            [Parameter.from_description(parameter) for parameter in self._describe()],
+            self.max_workers
+        )
 
     def __call__(self):
         names = self._get_names()
         return self._get_values(names)
 
 
+def fetch(name_prefixes, partitions=None, max_workers=DEFAULT_MAX_WORKERS, metadata_only=False,
+          group=False):
+    """Return the parameters for 'name_prefixes' in the format output by the command line."""
+    commands = CompileParameters(name_prefixes, partitions, max_workers)
+    parameters = commands.metadata() if metadata_only else commands()
+    if group:
+        parameters = commands.group_by_prefix(parameters)
+    return parameters
+
+
 if __name__ == "__main__":
+    from helper_daemon import DaemonError, DaemonUnavailable, request
+
     parser = argparse.ArgumentParser(description='Fetch parameters from AWS Parameter Store')
-    parser.add_argument('prefix', type=str)
+    parser.add_argument('prefix', type=str, nargs="+")
+    parser.add_argument('--metadata-only', action="store_true",
+                        help="Only describe parameters without fetching their values")
+    parser.add_argument('--group', action="store_true",
+                        help="Group parameters by the prefixes they match")
+    parser.add_argument('--partitions', nargs="*", metavar="SUFFIX",
+                        help="Enumerate sub-prefixes in parallel. Splits on every valid name "
+                             "character if no suffixes are given")
+    parser.add_argument('--max-workers', default=DEFAULT_MAX_WORKERS, type=int)
+    add_target_arguments(parser)
+    add_call_policy_arguments(parser)
 
     args = parser.parse_args()
-
-    commands = CompileParameters(args.prefix)
-    try:
-        parameters = commands()
-    except (NonZeroErrorCode, NoParametersFound) as error:
-        print(repr(error))
-        sys.exit(1)
-
-    print(json.dumps(parameters, indent=4))
+    configure_call_policy(args)
+
+    partitions = args.partitions
+    if partitions is not None and not partitions:
+        partitions = CompileParameters.name_characters
+
+    fetch_args = {
+        "name_prefixes": args.prefix,
+        "partitions": partitions,
+        "max_workers": args.max_workers,
+        "metadata_only": args.metadata_only,
+        "group": args.group,
+    }
+
+    if args.regions or args.profiles:
+        targets = get_targets(regions=args.regions, profiles=args.profiles)
+        output = []
+        for target, parameters, error in map_targets(lambda: fetch(**fetch_args), targets):
+            profile, region = target.labels
+            result = {"Profile": profile, "Region": region}
+            if error is not None:
+                result["Error"] = repr(error)
+            else:
+                result["Parameters"] = parameters
+            output.append(result)
+        print(json.dumps(output, indent=4))
+        if any("Error" in result for result in output):
+            sys.exit(1)
+    else:
+        errors = (NonZeroErrorCode, NoParametersFound, CommandTimeout)
+        try:
+            try:
+                parameters = request("fetch_params", errors, **fetch_args)
+            except DaemonUnavailable:
+                parameters = fetch(**fetch_args)
+        except errors + (DaemonError,) as error:
+            print(repr(error))
+            sys.exit(1)
+
+        print(json.dumps(parameters, indent=4))
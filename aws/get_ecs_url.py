@@ -17,20 +17,65 @@ Usage:
     instance of the first running task associated with this service will be printed to stdout.
 
     Errors will be raised if no service can be identified or there are no running tasks.
+
+    OPTIONAL:
+
+        --watch - Keep polling the service's running tasks, printing the private DNS of every
+                  task's instance whenever that set changes. Polls quickly while tasks are
+                  changing and backs off while they're stable. Only tasks which haven't been
+                  seen before are described, so a poll costs one call when nothing has changed.
+
+        --ssh   - Open an SSH session to the instance instead of printing its private DNS.
+
+        --exec <command>
+                - Run 'command' on the instance over SSH.
+
+        --each  - With '--exec', run the command on the instances of all of the service's tasks
+                  concurrently, prefixing each line of output with its instance's private DNS.
+
+        --prefer-az <zone>
+                - Prefer instances in this availability zone, falling back to others. Pass 'auto'
+                  to detect the zone of the machine running the script from the metadata source
+                  given by '--az-source', which is a URL or a file path. By default, this is the
+                  EC2 instance metadata service. Defaults to AWS_SCRIPTS_PREFER_AZ, if set. The
+                  zone is read from instance descriptions which are fetched anyway, so no
+                  further calls are made.
+
+    SSH connections are shared using ControlMaster, with a socket for each instance kept open for
+    '--control-persist' (default 10 minutes) after the last session closes. Repeated commands
+    reuse one authenticated connection rather than making a new one each time.
 """
 
 import argparse
+import os
 import sys
+import threading
+
+from subprocess import Popen, PIPE, STDOUT
+from time import sleep
 
 from common import (
     BaseCommand,
-    BasePaginatedCommand,
+    CommandTimeout,
     NonZeroErrorCode,
+    grouper,
+    map_concurrently,
+    add_call_policy_arguments,
+    configure_call_policy,
     ListClusters,
     ListServices,
 )
 
 
+SSH_CONTROL_DIR = os.path.expanduser("~/.ssh/aws-scripts")
+DEFAULT_CONTROL_PERSIST = "10m"
+
+PREFER_AZ_VARIABLE = "AWS_SCRIPTS_PREFER_AZ"
+AZ_SOURCE_VARIABLE = "AWS_SCRIPTS_AZ_SOURCE"
+METADATA_URL = "http://169.254.169.254/latest/"
+DEFAULT_AZ_SOURCE = METADATA_URL + "meta-data/placement/availability-zone"
+
+
 class NoResourceFound(Exception):
     pass
 
@@ -62,15 +107,22 @@ class DescribeTasks(BaseCommand):
     results_key = "tasks"
     container_instance_key = "containerInstanceArn"
 
-    def __init__(self, cluster_arn, task_arn):
+    task_arn_key = "taskArn"
+
+    max_length = 100
+
+    def __init__(self, cluster_arn, task_arn=None, task_arns=None):
         self.cluster_arn = cluster_arn
-        self.task_arn = task_arn
+        self.task_arns = task_arns or [task_arn]
+        if len(self.task_arns) > self.max_length:
+            msg = "Can't describe more than {} tasks at once.".format(self.max_length)
+            raise AssertionError(msg)
 
     @property
     def call_args(self):
         args = super().call_args
         args += ["--cluster", self.cluster_arn]
-        args += ["--tasks", self.task_arn]
+        args += ["--tasks", *self.task_arns]
         return args
 
 
@@ -79,17 +131,25 @@ class DescribeContainerInstances(BaseCommand):
     base_command = "aws ecs describe-container-instances"
 
     results_key = "containerInstances"
+    container_instance_key = "containerInstanceArn"
     ec2_instance_key = "ec2InstanceId"
 
-    def __init__(self, cluster_arn, container_arn):
+    max_length = 100
+
+    def __init__(self, cluster_arn, container_arn=None, container_arns=None):
         self.cluster_arn = cluster_arn
-        self.container_arn = container_arn
+        self.container_arns = container_arns or [container_arn]
+        if len(self.container_arns) > self.max_length:
+            msg = "Can't describe more than {} container instances at once.".format(
+                self.max_length
+            )
+            raise AssertionError(msg)
 
     @property
     def call_args(self):
         args = super().call_args
         args += ["--cluster", self.cluster_arn]
-        args += ["--container-instances", self.container_arn]
+        args += ["--container-instances", *self.container_arns]
         return args
 
 
@@ -99,15 +159,18 @@ class DescribeEc2Instances(BaseCommand):
 
     reservations_key = "Reservations"
     instances_key = "Instances"
+    instance_id_key = "InstanceId"
     dns_url_key = "PrivateDnsName"
+    placement_key = "Placement"
+    availability_zone_key = "AvailabilityZone"
 
-    def __init__(self, instance_id):
-        self.instance_id = instance_id
+    def __init__(self, instance_id=None, instance_ids=None):
+        self.instance_ids = instance_ids or [instance_id]
 
     @property
     def call_args(self):
         args = super().call_args
-        args += ["--instance-ids", self.instance_id]
+        args += ["--instance-ids", *self.instance_ids]
         return args
 
 
@@ -126,35 +189,257 @@ def match_arn(name, arns):
     return matches[0]
 
 
-def main(cluster_name, service_name):
+def resolve_service(cluster_name, service_name):
+    """Return the ARNs of the cluster and service identified by the given names."""
     clusters = ListClusters.get_all()
     cluster_arn = match_arn(cluster_name, clusters)
 
     services = ListServices.get_all(cluster_arn=cluster_arn)
     service_arn = match_arn(service_name, services)
+    return cluster_arn, service_arn
+
 
+def list_task_arns(cluster_arn, service_arn):
     tasks_command = ListTasks(cluster_arn=cluster_arn, service_arn=service_arn)
-    task_arns = tasks_command()[ListTasks.results_key]
+    return tasks_command()[ListTasks.results_key]
+
+
+def get_container_instances(cluster_arn, task_arns):
+    """Return a dict mapping each of 'task_arns' to its container instance ARN."""
+    container_instances = {}
+    for task_arns_subset in grouper(task_arns, DescribeTasks.max_length):
+        task_command = DescribeTasks(
+            cluster_arn=cluster_arn, task_arns=[arn for arn in task_arns_subset if arn]
+        )
+        container_instances.update(
+            (task[DescribeTasks.task_arn_key], task[DescribeTasks.container_instance_key])
+            for task in task_command()[DescribeTasks.results_key]
+        )
+    return container_instances
+
+
+def get_ec2_instances(cluster_arn, container_arns):
+    """Return a dict mapping each of 'container_arns' to its EC2 instance description."""
+    containers = []
+    for container_arns_subset in grouper(container_arns, DescribeContainerInstances.max_length):
+        container_command = DescribeContainerInstances(
+            cluster_arn=cluster_arn, container_arns=[arn for arn in container_arns_subset if arn]
+        )
+        containers += container_command()[DescribeContainerInstances.results_key]
+    ec2_instance_ids = {
+        container[DescribeContainerInstances.container_instance_key]:
+            container[DescribeContainerInstances.ec2_instance_key]
+        for container in containers
+    }
+
+    ec2_instance_command = DescribeEc2Instances(
+        instance_ids=list(dict.fromkeys(ec2_instance_ids.values()))
+    )
+    instances = {
+        instance[DescribeEc2Instances.instance_id_key]: instance
+        for reservation in ec2_instance_command()[DescribeEc2Instances.reservations_key]
+        for instance in reservation[DescribeEc2Instances.instances_key]
+    }
+    return {
+        container_arn: instances[instance_id]
+        for container_arn, instance_id in ec2_instance_ids.items()
+    }
+
+
+def get_task_instances(cluster_arn, task_arns):
+    """Return the EC2 instance description of each of 'task_arns', in the same order.
+
+    Costs one call for each kind of resource per hundred tasks.
+    """
+    task_containers = get_container_instances(cluster_arn, task_arns)
+    instances = get_ec2_instances(cluster_arn, list(dict.fromkeys(task_containers.values())))
+    return [instances[task_containers[arn]] for arn in task_arns if arn in task_containers]
+
+
+def get_availability_zone(instance):
+    placement = instance.get(DescribeEc2Instances.placement_key, {})
+    return placement.get(DescribeEc2Instances.availability_zone_key)
+
+
+def choose_instance(instances, prefer_az=None):
+    """Return the first of 'instances' in the availability zone 'prefer_az', if there is one.
+
+    Otherwise, return the first instance.
+    """
+    for instance in instances:
+        if prefer_az is not None and get_availability_zone(instance) == prefer_az:
+            return instance
+    return instances[0]
+
+
+def detect_availability_zone(source=None, timeout=1):
+    """Return the availability zone of this machine, or None if it can't be found.
+
+    'source' is a URL or a file path to read the zone from, defaulting to AWS_SCRIPTS_AZ_SOURCE
+    or the EC2 instance metadata service.
+    """
+    from urllib.request import Request, urlopen
+
+    source = source or os.environ.get(AZ_SOURCE_VARIABLE) or DEFAULT_AZ_SOURCE
+    try:
+        if "://" not in source:
+            with open(source) as source_file:
+                return source_file.read().strip() or None
+
+        headers = {}
+        if source.startswith(METADATA_URL):
+            # The instance metadata service requires a session token, unless it allows IMDSv1
+            token_request = Request(
+                METADATA_URL + "api/token", method="PUT",
+                headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"}
+            )
+            try:
+                with urlopen(token_request, timeout=timeout) as response:
+                    headers["X-aws-ec2-metadata-token"] = response.read().decode()
+            except OSError:
+                pass
+        with urlopen(Request(source, headers=headers), timeout=timeout) as response:
+            return response.read().decode().strip() or None
+    except (OSError, ValueError):
+        return None
+
+
+def main(cluster_name, service_name, prefer_az=None):
+    cluster_arn, service_arn = resolve_service(cluster_name, service_name)
+
+    task_arns = list_task_arns(cluster_arn, service_arn)
 
     if not task_arns:
         msg = f"No running tasks found for service {service_arn}"
         raise NoResourceFound(msg)
 
-    task_arn = task_arns[0]
-    task_command = DescribeTasks(cluster_arn=cluster_arn, task_arn=task_arn)
-    task = task_command()[DescribeTasks.results_key][0]
+    # Choosing between instances means describing every task, but the number of calls is the same
+    if prefer_az is None:
+        task_arns = task_arns[:1]
+    instance = choose_instance(get_task_instances(cluster_arn, task_arns), prefer_az)
+    return instance[DescribeEc2Instances.dns_url_key]
 
-    container_arn = task[DescribeTasks.container_instance_key]
-    container_command = DescribeContainerInstances(
-        cluster_arn=cluster_arn, container_arn=container_arn
-    )
-    container = container_command()[DescribeContainerInstances.results_key][0]
-    ec2_instance_id = container[DescribeContainerInstances.ec2_instance_key]
 
-    ec2_instance_command = DescribeEc2Instances(instance_id=ec2_instance_id)
-    reservation = ec2_instance_command()[DescribeEc2Instances.reservations_key][0]
-    instance = reservation[DescribeEc2Instances.instances_key][0]
-    return instance[DescribeEc2Instances.dns_url_key]
+def get_hosts(cluster_name, service_name):
+    """Return the private DNS of the instances running each of the service's tasks."""
+    cluster_arn, service_arn = resolve_service(cluster_name, service_name)
+
+    task_arns = list_task_arns(cluster_arn, service_arn)
+
+    if not task_arns:
+        msg = f"No running tasks found for service {service_arn}"
+        raise NoResourceFound(msg)
+
+    return list(dict.fromkeys(
+        instance[DescribeEc2Instances.dns_url_key]
+        for instance in get_task_instances(cluster_arn, task_arns)
+    ))
+
+
+def get_ssh_args(host, command=None, control_persist=DEFAULT_CONTROL_PERSIST, batch=False):
+    """Return the arguments for running 'command' on 'host' over a shared SSH connection.
+
+    The connection's socket is keyed by the host, port and user. With 'batch', SSH won't read
+    from stdin or prompt for passwords, so several can safely run at once.
+    """
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+    args = [
+        "ssh",
+        "-o", "ControlMaster=auto",
+        "-o", "ControlPath={}".format(os.path.join(SSH_CONTROL_DIR, "%C")),
+        "-o", "ControlPersist={}".format(control_persist),
+    ]
+    if batch:
+        args += ["-n", "-o", "BatchMode=yes"]
+    args.append(host)
+    if command:
+        args.append(command)
+    return args
+
+
+def run_each(hosts, command, control_persist=DEFAULT_CONTROL_PERSIST, output=print):
+    """Run 'command' on each of 'hosts' concurrently, prefixing each line of output with its host.
+
+    Returns the highest exit status, counting an SSH process killed by a signal as 128 plus the
+    signal number, as a shell would.
+    """
+    lock = threading.Lock()
+
+    def run_on_host(host):
+        process = Popen(
+            get_ssh_args(host, command, control_persist, batch=True), stdout=PIPE, stderr=STDOUT
+        )
+        for line in process.stdout:
+            with lock:
+                output("{}: {}".format(host, line.decode(errors="replace").rstrip("\n")))
+        returncode = process.wait()
+        return 128 - returncode if returncode < 0 else returncode
+
+    return max(map_concurrently(run_on_host, hosts, max_workers=len(hosts)))
+
+
+class ServiceWatcher:
+    """Tracks the private DNS of the instances running a service's tasks.
+
+    Task and container instance descriptions are remembered between polls, so only tasks which
+    haven't been seen before are described. A poll in which the set of tasks is unchanged costs a
+    single 'list-tasks' call.
+    """
+
+    def __init__(self, cluster_arn, service_arn):
+        self.cluster_arn = cluster_arn
+        self.service_arn = service_arn
+        self.task_containers = {}
+        self.container_hosts = {}
+
+    @property
+    def hosts(self):
+        return {self.container_hosts[arn] for arn in self.task_containers.values()}
+
+    def poll(self):
+        """Refresh the service's tasks, returning True if they've changed since the last poll."""
+        task_arns = list_task_arns(self.cluster_arn, self.service_arn)
+        new_task_arns = [arn for arn in task_arns if arn not in self.task_containers]
+        changed = bool(new_task_arns) or len(task_arns) != len(self.task_containers)
+
+        task_containers = {
+            arn: container for arn, container in self.task_containers.items() if arn in task_arns
+        }
+        if new_task_arns:
+            task_containers.update(get_container_instances(self.cluster_arn, new_task_arns))
+
+        new_container_arns = [
+            arn for arn in dict.fromkeys(task_containers.values())
+            if arn not in self.container_hosts
+        ]
+        if new_container_arns:
+            instances = get_ec2_instances(self.cluster_arn, new_container_arns)
+            for container_arn, instance in instances.items():
+                self.container_hosts[container_arn] = instance[DescribeEc2Instances.dns_url_key]
+
+        self.task_containers = task_containers
+        return changed
+
+
+def watch(cluster_name, service_name, min_interval=2, max_interval=30, output=print):
+    """Output the service's hosts whenever they change, until interrupted.
+
+    The polling interval drops to 'min_interval' whenever the service's tasks change, which is
+    usually because a deployment is in progress, and doubles up to 'max_interval' after each poll
+    in which they don't.
+    """
+    watcher = ServiceWatcher(*resolve_service(cluster_name, service_name))
+    hosts = None
+    interval = min_interval
+    while True:
+        if watcher.poll():
+            interval = min_interval
+        else:
+            interval = min(interval * 2, max_interval)
+        if watcher.hosts != hosts:
+            hosts = watcher.hosts
+            output(" ".join(sorted(hosts)))
+        sleep(interval)
 
 
 if __name__ == "__main__":
@@ -163,11 +448,68 @@ if __name__ == "__main__":
     )
     parser.add_argument("cluster", type=str)
     parser.add_argument("service", type=str)
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="Keep printing the service's hosts whenever they change"
+    )
+    parser.add_argument("--min-interval", default=2, type=float,
+                        help="Seconds between polls while tasks are changing")
+    parser.add_argument("--max-interval", default=30, type=float,
+                        help="Maximum seconds between polls while tasks are stable")
+    parser.add_argument("--ssh", action="store_true", help="Open an SSH session to the instance")
+    parser.add_argument("--exec", dest="command", help="Run a command on the instance over SSH")
+    parser.add_argument("--each", action="store_true",
+                        help="Run the '--exec' command on the instances of every task")
+    parser.add_argument("--control-persist", default=DEFAULT_CONTROL_PERSIST,
+                        help="How long shared SSH connections stay open after they're last used")
+    parser.add_argument("--prefer-az", default=os.environ.get(PREFER_AZ_VARIABLE),
+                        help="Prefer instances in this availability zone, or 'auto' to detect it")
+    parser.add_argument("--az-source",
+                        help="A URL or file to read the availability zone from for 'auto'")
+
+    add_call_policy_arguments(parser)
 
     args = parser.parse_args()
+    configure_call_policy(args)
+
+    if args.each and not args.command:
+        parser.error("--each requires --exec")
+    if args.watch and (args.ssh or args.command):
+        parser.error("--watch can't be combined with --ssh or --exec")
+
+    prefer_az = args.prefer_az
+    if prefer_az == "auto":
+        prefer_az = detect_availability_zone(args.az_source)
+        if prefer_az is None:
+            print("Couldn't detect availability zone. Using any zone", file=sys.stderr)
+
+    from helper_daemon import DaemonError, DaemonUnavailable, request
+
+    errors = (NonZeroErrorCode, NoResourceFound, CommandTimeout)
+
+    def resolve(command, func, **kwargs):
+        try:
+            return request(command, errors, cluster_name=args.cluster, service_name=args.service,
+                           **kwargs)
+        except DaemonUnavailable:
+            return func(args.cluster, args.service, **kwargs)
 
     try:
-        print(main(args.cluster, args.service))
-    except (NonZeroErrorCode, NoResourceFound) as error:
+        if args.watch:
+            watch(args.cluster, args.service, args.min_interval, args.max_interval,
+                  output=lambda line: print(line, flush=True))
+        elif args.each:
+            hosts = resolve("get_ecs_hosts", get_hosts)
+            sys.exit(run_each(hosts, args.command, args.control_persist,
+                              output=lambda line: print(line, flush=True)))
+        else:
+            url = resolve("get_ecs_url", main, prefer_az=prefer_az)
+            if args.ssh or args.command:
+                ssh_args = get_ssh_args(url, args.command, args.control_persist)
+                os.execvp(ssh_args[0], ssh_args)
+            print(url)
+    except errors + (DaemonError,) as error:
         print(str(error))
         sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,344 @@
+"""
+An optional long-lived helper which serves get_ecs_url, list_ecs_services and fetch_params over a
+Unix domain socket.
+
+Each invocation of those scripts otherwise pays for Python start-up and starts from an empty
+cache. While the helper is running, they send their request to it instead and it answers using
+results cached in memory. Cluster and service lists are cached for five minutes and parameter
+names for one minute. Parameter values are never cached, since they may have been decrypted.
+set_param empties the cache after changing a parameter. If the helper isn't running, the scripts
+do the work themselves as usual.
+
+The helper only serves clients whose credentials and CLI configuration come from the default
+files and a CLI profile, since those set in a client's environment aren't visible to it. That
+includes endpoint, CA bundle and proxy settings. Set AWS_SCRIPTS_NO_DAEMON to bypass it entirely.
+
+The socket lives in XDG_RUNTIME_DIR, or otherwise in a directory under /tmp which only the
+current user may access. Clients refuse to connect to a socket owned by anyone else.
+
+Usage:
+
+    python helper_daemon.py start [--idle-timeout <seconds>]
+
+        Start the helper in the background. It exits after 'idle-timeout' seconds (default 15
+        minutes) without a request.
+
+    python helper_daemon.py serve [--idle-timeout <seconds>]
+
+        Run the helper in the foreground.
+
+    python helper_daemon.py stats
+
+        Print the helper's uptime, request count, cache hit / miss statistics and the calls
+        made and time waited on each shared rate limit.
+
+    python helper_daemon.py clear
+
+        Empty the helper's cache.
+
+    python helper_daemon.py stop
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+
+from subprocess import Popen, DEVNULL
+from time import monotonic, sleep
+
+
+DEFAULT_IDLE_TIMEOUT = 15 * 60
+
+CLIENT_TIMEOUT = 120
+
+DISABLE_VARIABLE = "AWS_SCRIPTS_NO_DAEMON"
+CREDENTIAL_VARIABLES = (
+    "AWS_ACCESS_KEY_ID",
+    "AWS_SESSION_TOKEN",
+    "AWS_CONFIG_FILE",
+    "AWS_SHARED_CREDENTIALS_FILE",
+    "AWS_ROLE_ARN",
+    "AWS_WEB_IDENTITY_TOKEN_FILE",
+    "AWS_CA_BUNDLE",
+    "AWS_USE_FIPS_ENDPOINT",
+    "AWS_USE_DUALSTACK_ENDPOINT",
+    "HTTPS_PROXY",
+    "HTTP_PROXY",
+    "https_proxy",
+    "http_proxy",
+)
+# Endpoint overrides, such as AWS_ENDPOINT_URL_SSM, and container credential settings
+CREDENTIAL_PREFIXES = ("AWS_ENDPOINT_URL", "AWS_CONTAINER_")
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+class DaemonError(Exception):
+    pass
+
+
+def get_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        tempfile.gettempdir(), "aws-scripts-{}".format(os.getuid())
+    )
+    return os.path.join(runtime_dir, "aws-scripts-{}.sock".format(os.getuid()))
+
+
+def _check_socket(socket_path):
+    """Raise 'DaemonUnavailable' unless the socket and its directory belong to the current user."""
+    from common import InsecureDirectory, check_private_directory
+
+    try:
+        check_private_directory(os.path.dirname(socket_path))
+        if os.lstat(socket_path).st_uid != os.getuid():
+            raise DaemonUnavailable("{} is owned by another user".format(socket_path))
+    except (OSError, InsecureDirectory) as error:
+        raise DaemonUnavailable(str(error))
+
+
+def _send(message, timeout=CLIENT_TIMEOUT):
+    """Send 'message' to the helper and return its response.
+
+    Raises 'DaemonUnavailable' if the message can't be sent, or 'DaemonError' if it was sent but
+    no response arrived within 'timeout' seconds.
+    """
+    socket_path = get_socket_path()
+    _check_socket(socket_path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(socket_path)
+    except OSError as error:
+        client.close()
+        raise DaemonUnavailable(str(error))
+    with client, client.makefile("rwb") as stream:
+        try:
+            stream.write(json.dumps(message).encode() + b"\n")
+            stream.flush()
+        except OSError as error:
+            raise DaemonUnavailable(str(error))
+        # The helper may already be working on the request, so running it again here would do
+        # the work twice
+        try:
+            response = stream.readline()
+        except OSError as error:
+            raise DaemonError("No response from the helper: {}".format(error))
+    if not response:
+        raise DaemonError("Connection closed without a response")
+    return json.loads(response.decode())
+
+
+def get_credential_variables():
+    """Return the variables set in the environment which the helper wouldn't see."""
+    return [
+        variable for variable, value in os.environ.items()
+        if value and (variable in CREDENTIAL_VARIABLES or variable.startswith(CREDENTIAL_PREFIXES))
+    ]
+
+
+def request(command, errors=(), **kwargs):
+    """Run 'command' with 'kwargs' using the helper, if it's running.
+
+    The client's AWS profile and region are forwarded. Errors raised by the command are re-raised
+    as the matching class in 'errors', or as 'DaemonError' if there's no match.
+
+    Raises 'DaemonUnavailable' if the helper isn't running or shouldn't be used. Since timeouts
+    and hedging apply to calls made within this process, the helper isn't used if they're set.
+    Raises 'DaemonError' if the helper accepted the request but didn't answer it.
+    """
+    import common
+
+    if os.environ.get(DISABLE_VARIABLE) or get_credential_variables():
+        raise DaemonUnavailable("Helper bypassed for this environment")
+    if not common.call_policy.is_default:
+        raise DaemonUnavailable("Helper bypassed for timeouts and hedging")
+
+    response = _send({
+        "command": command,
+        "kwargs": kwargs,
+        "profile": os.environ.get("AWS_PROFILE"),
+        "region": os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION"),
+    })
+    if "error" not in response:
+        return response["result"]
+
+    error = response["error"]
+    for error_class in errors:
+        if error_class.__name__ == error["type"]:
+            raise error_class(*error["args"])
+    raise DaemonError("{}{}".format(error["type"], tuple(error["args"])))
+
+
+def clear_cache():
+    """Empty the helper's cache, if it's running, so later requests see changes just made."""
+    try:
+        _send({"command": "clear"}, timeout=1)
+    except (DaemonUnavailable, DaemonError):
+        pass
+
+
+def _get_ecs_url(cluster_name, service_name, prefer_az=None):
+    from get_ecs_url import main
+    return main(cluster_name, service_name, prefer_az)
+
+
+def _get_ecs_hosts(cluster_name, service_name):
+    from get_ecs_url import get_hosts
+    return get_hosts(cluster_name, service_name)
+
+
+def _list_ecs_services(show_arns=False, show_status=False):
+    from list_ecs_services import get_lines
+    return get_lines(show_arns, show_status)
+
+
+def _fetch_params(**kwargs):
+    from fetch_params import fetch
+    return fetch(**kwargs)
+
+
+COMMANDS = {
+    "get_ecs_url": _get_ecs_url,
+    "get_ecs_hosts": _get_ecs_hosts,
+    "list_ecs_services": _list_ecs_services,
+    "fetch_params": _fetch_params,
+}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.server.touch()
+        message = json.loads(self.rfile.readline().decode())
+        try:
+            response = {"result": self.server.dispatch(message)}
+        except Exception as error:
+            args = [arg if isinstance(arg, (str, int, float)) else str(arg) for arg in error.args]
+            response = {"error": {"type": type(error).__name__, "args": args}}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class HelperServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        from common import BaseCommand, ResultCache, make_private_directory
+
+        self.idle_timeout = idle_timeout
+        self.started = monotonic()
+        self.last_request = self.started
+        self.requests = 0
+        self.cache = ResultCache()
+        BaseCommand.cache = self.cache
+
+        make_private_directory(os.path.dirname(socket_path))
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        previous_umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, RequestHandler)
+        finally:
+            os.umask(previous_umask)
+
+    def touch(self):
+        self.last_request = monotonic()
+        self.requests += 1
+
+    def stats(self):
+        from common import get_rate_limiter
+
+        return {
+            "uptime": monotonic() - self.started,
+            "idle": monotonic() - self.last_request,
+            "requests": self.requests,
+            "cache": self.cache.stats(),
+            "rate_limits": get_rate_limiter().stats(),
+        }
+
+    def dispatch(self, message):
+        from common import Target, use_target
+
+        command = message["command"]
+        if command == "stats":
+            return self.stats()
+        if command == "clear":
+            self.cache.clear()
+            return self.stats()
+        if command == "stop":
+            threading.Thread(target=self.shutdown).start()
+            return self.stats()
+
+        target = Target(region=message.get("region"), profile=message.get("profile"))
+        with use_target(target):
+            return COMMANDS[command](**message.get("kwargs", {}))
+
+    def watch_idle(self):
+        """Shut down once no request has been received for 'idle_timeout' seconds."""
+        while monotonic() - self.last_request < self.idle_timeout:
+            sleep(min(self.idle_timeout, 10))
+        self.shutdown()
+
+
+def serve(idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    # Each request carries the client's own profile and region
+    for variable in ("AWS_PROFILE", "AWS_REGION", "AWS_DEFAULT_REGION"):
+        os.environ.pop(variable, None)
+
+    socket_path = get_socket_path()
+    server = HelperServer(socket_path, idle_timeout)
+    threading.Thread(target=server.watch_idle, daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def start(idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Start the helper in a detached process, unless it's already running."""
+    try:
+        _send({"command": "stats"}, timeout=1)
+        return
+    except DaemonError:
+        # Running, but too busy to answer in time
+        return
+    except DaemonUnavailable:
+        pass
+    Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--idle-timeout", str(idle_timeout)],
+        stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the AWS scripts from a long-lived helper process"
+    )
+    parser.add_argument("action", choices=["start", "serve", "stats", "clear", "stop"])
+    parser.add_argument("--idle-timeout", default=DEFAULT_IDLE_TIMEOUT, type=float,
+                        help="Exit after this many seconds without a request")
+
+    args = parser.parse_args()
+
+    if args.action == "start":
+        start(args.idle_timeout)
+    elif args.action == "serve":
+        serve(args.idle_timeout)
+    else:
+        try:
+            print(json.dumps(_send({"command": args.action})["result"], indent=4))
+        except DaemonUnavailable:
+            print("Helper is not running")
+            sys.exit(1)
+        except DaemonError as error:
+            print(repr(error))
+            sys.exit(1)
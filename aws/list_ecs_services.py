@@ -12,35 +12,150 @@ Pass '--arn' argument to print full arns instead:
     arn:aws:ecs:~~~~/cluster_a arn:aws:ecs:~~~~/service_a
     arn:aws:ecs:~~~~/cluster_a arn:aws:ecs:~~~~/service_b
     arn:aws:ecs:~~~~/cluster_b arn:aws:ecs:~~~~/service_c
+
+Pass '--status' to add the running and desired task counts and deployment state of each service:
+
+    cluster_a service_a 2/2 COMPLETED
+    cluster_a service_b 1/3 IN_PROGRESS
+
+Pass '--regions' and / or '--profiles' to list services for each combination of region and CLI
+profile in parallel. Each line is then prefixed with the profile and region:
+
+    default eu-west-1 cluster_a service_a
+    default us-east-1 cluster_b service_c
 """
 
 import argparse
 import sys
 
 from common import (
+    BaseCommand,
+    CommandTimeout,
+    NonZeroErrorCode,
+    add_call_policy_arguments,
+    configure_call_policy,
     ListClusters,
     ListServices,
+    add_target_arguments,
+    get_targets,
+    grouper,
+    map_concurrently,
+    map_targets,
 )
 
 
+class DescribeServices(BaseCommand):
+
+    base_command = "aws ecs describe-services"
+
+    results_key = "services"
+    service_arn_key = "serviceArn"
+    running_count_key = "runningCount"
+    desired_count_key = "desiredCount"
+    deployments_key = "deployments"
+
+    max_length = 10
+
+    def __init__(self, cluster_arn, service_arns):
+        self.cluster_arn = cluster_arn
+        self.service_arns = service_arns
+        if not self.service_arns:
+            raise AssertionError("One or more service ARNs must be provided.")
+        elif len(self.service_arns) > self.max_length:
+            msg = "Can't describe more than {} services at once.".format(self.max_length)
+            raise AssertionError(msg)
+
+    @property
+    def call_args(self):
+        args = super().call_args
+        args += ["--cluster", self.cluster_arn]
+        args += ["--services", *self.service_arns]
+        return args
+
+
 def get_name_from_arn(arn):
     *_, name = arn.split("/")
     return name
 
 
-def main(show_arns=False):
+def get_deployment_state(service):
+    """Return the rollout state of the service's primary deployment."""
+    deployments = service.get(DescribeServices.deployments_key, [])
+    for deployment in deployments:
+        if deployment.get("status") == "PRIMARY" and "rolloutState" in deployment:
+            return deployment["rolloutState"]
+    return "STEADY" if len(deployments) <= 1 else "DEPLOYING"
+
+
+def get_service_statuses(cluster_arn, service_arns):
+    """Return a status string for each service, describing services in as few calls as possible."""
+    statuses = {}
+    for service_arns_subset in grouper(service_arns, DescribeServices.max_length):
+        command = DescribeServices(
+            cluster_arn, [service_arn for service_arn in service_arns_subset if service_arn]
+        )
+        for service in command()[DescribeServices.results_key]:
+            statuses[service[DescribeServices.service_arn_key]] = "{}/{} {}".format(
+                service[DescribeServices.running_count_key],
+                service[DescribeServices.desired_count_key],
+                get_deployment_state(service),
+            )
+    return statuses
+
+
+def get_services(show_status=False):
+    """Return '(cluster_arn, service_arns, statuses)' tuples for every available cluster.
+
+    'statuses' maps service ARNs to status strings if 'show_status' is set and is empty otherwise.
+    Clusters are queried concurrently.
+    """
     clusters = ListClusters.get_all()
 
-    for cluster_arn in clusters:
+    def list_services(cluster_arn):
         services = ListServices.get_all(cluster_arn=cluster_arn)
+        statuses = {}
+        if show_status and services:
+            statuses = get_service_statuses(cluster_arn, services)
+        return cluster_arn, services, statuses
+
+    return map_concurrently(list_services, clusters)
+
+
+def get_lines(show_arns=False, show_status=False):
+    lines = []
+    for cluster_arn, services, statuses in get_services(show_status):
         cluster_name = get_name_from_arn(cluster_arn)
         for service_arn in services:
             service_name = get_name_from_arn(service_arn)
 
             if show_arns:
-                print(cluster_arn, service_arn)
+                line = [cluster_arn, service_arn]
             else:
-                print(cluster_name, service_name)
+                line = [cluster_name, service_name]
+            if show_status:
+                line.append(statuses.get(service_arn, "MISSING"))
+            lines.append(" ".join(line))
+    return lines
+
+
+def main(show_arns=False, show_status=False):
+    for line in get_lines(show_arns, show_status):
+        print(line)
+
+
+def main_for_targets(targets, show_arns=False, show_status=False):
+    """Print services for each of 'targets', returning False if any target failed."""
+    succeeded = True
+    lines_by_target = map_targets(lambda: get_lines(show_arns, show_status), targets)
+    for target, lines, error in lines_by_target:
+        labels = " ".join(target.labels)
+        if error is not None:
+            print(labels, repr(error), file=sys.stderr)
+            succeeded = False
+            continue
+        for line in lines:
+            print(labels, line)
+    return succeeded
 
 
 if __name__ == "__main__":
@@ -50,7 +165,33 @@ if __name__ == "__main__":
     parser.add_argument(
         "--arn", action="store_true", help="Print full ARNs instead of just names"
     )
+    parser.add_argument(
+        "--status", action="store_true",
+        help="Show running / desired task counts and deployment state for each service"
+    )
+    add_target_arguments(parser)
 
-    args = parser.parse_args()
+    add_call_policy_arguments(parser)
 
-    main(show_arns=args.arn)
+    args = parser.parse_args()
+    configure_call_policy(args)
+
+    if args.regions or args.profiles:
+        targets = get_targets(regions=args.regions, profiles=args.profiles)
+        if not main_for_targets(targets, show_arns=args.arn, show_status=args.status):
+            sys.exit(1)
+    else:
+        from helper_daemon import DaemonError, DaemonUnavailable, request
+
+        errors = (NonZeroErrorCode, CommandTimeout)
+        try:
+            try:
+                lines = request("list_ecs_services", errors, show_arns=args.arn,
+                                show_status=args.status)
+            except DaemonUnavailable:
+                lines = get_lines(show_arns=args.arn, show_status=args.status)
+        except errors + (DaemonError,) as error:
+            print(repr(error))
+            sys.exit(1)
+        for line in lines:
+            print(line)
@@ -0,0 +1,169 @@
+"""
+A command-line utility for auditing how Parameter Store parameters have changed over time.
+
+Usage:
+
+    Provide:
+
+        <name-prefix> - The string by which to filter parameters. Several prefixes may be given.
+
+    Writes one JSON object per line for every version of every parameter with a name beginning
+    with 'name-prefix', ordered by modification time. Parameters are discovered as in
+    'fetch_params', then the history of each parameter is fetched concurrently.
+
+    OPTIONAL:
+
+        --since <date>          - Only include versions modified at or after this ISO 8601 date
+                                  or time, e.g. '2024-01-31' or '2024-01-31T09:00:00+00:00'.
+
+        --hash-secure-strings   - Decrypt SecureString values and replace them with their SHA-256
+                                  hash, so changes can be seen without revealing values. By
+                                  default, SecureString values are left encrypted.
+
+        --max-workers <n>       - The number of parameters to fetch history for at once.
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import sys
+
+from datetime import datetime, timezone
+
+from common import (
+    BaseCommand,
+    CommandTimeout,
+    NonZeroErrorCode,
+    DEFAULT_MAX_WORKERS,
+    add_call_policy_arguments,
+    configure_call_policy,
+    map_concurrently,
+)
+from fetch_params import CompileParameters, NoParametersFound
+
+
+class GetParameterHistory(BaseCommand):
+    """An object representing a single 'aws ssm get-parameter-history' command."""
+
+    base_command = "aws ssm get-parameter-history"
+
+    name_arg = "--name"
+    decryption_arg = "--with-decryption"
+    next_arg = "--next-token"
+
+    parameters_key = "Parameters"
+    next_token_key = "NextToken"
+
+    def __init__(self, name, next_token=None, with_decryption=False):
+        self.name = name
+        self.next_token = next_token
+        self.with_decryption = with_decryption
+
+    @property
+    def call_args(self):
+        args = super().call_args
+        args += [self.name_arg, self.name]
+        if self.with_decryption:
+            args.append(self.decryption_arg)
+        if self.next_token:
+            args += [self.next_arg, self.next_token]
+        return args
+
+
+def parse_timestamp(value):
+    """Return seconds since the epoch for a timestamp output by the AWS CLI or given by a user.
+
+    Version 1 of the CLI outputs timestamps as seconds since the epoch and version 2 as ISO 8601
+    strings. Times without a timezone are assumed to be UTC.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # Python 3.6 can't parse a colon in the UTC offset
+    timestamp = value.replace("Z", "+00:00")
+    if len(timestamp) >= 6 and timestamp[-3] == ":" and timestamp[-6] in ("+", "-"):
+        timestamp = timestamp[:-3] + timestamp[-2:]
+    for time_format in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z",
+                        "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(timestamp, time_format)
+        except ValueError:
+            continue
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    raise ValueError("Unrecognised timestamp: {}".format(value))
+
+
+def hash_value(value):
+    return "sha256:" + hashlib.sha256(value.encode()).hexdigest()
+
+
+class CompileHistory:
+    """Compile the version history of every parameter beginning with any of 'name_prefixes'.
+
+    Each parameter's history pages are walked independently, with parameters fetched
+    concurrently. Versions are yielded in order of modification time.
+    """
+
+    secure_string_type = "SecureString"
+
+    def __init__(self, name_prefixes, since=None, hash_secure_strings=False,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        self.name_prefixes = name_prefixes
+        self.since = since
+        self.hash_secure_strings = hash_secure_strings
+        self.max_workers = max_workers
+
+    def _get_history(self, name):
+        """Return the versions of parameter 'name', oldest first."""
+        versions = []
+        next_token = None
+        while True:
+            results = GetParameterHistory(name, next_token, self.hash_secure_strings)()
+            versions.extend(results.get(GetParameterHistory.parameters_key, []))
+            next_token = results.get(GetParameterHistory.next_token_key, None)
+            if not next_token:
+                break
+
+        history = []
+        for version in versions:
+            modified = parse_timestamp(version["LastModifiedDate"])
+            if self.since is not None and modified < self.since:
+                continue
+            if self.hash_secure_strings and version.get("Type") == self.secure_string_type:
+                version = {**version, "Value": hash_value(version["Value"])}
+            history.append((modified, name, version))
+        return sorted(history, key=lambda entry: entry[0])
+
+    def __call__(self):
+        names = CompileParameters(self.name_prefixes, max_workers=self.max_workers).names()
+        histories = map_concurrently(self._get_history, names, self.max_workers)
+        for _, _, version in heapq.merge(*histories, key=lambda entry: entry[:2]):
+            yield version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch the version history of parameters from AWS Parameter Store"
+    )
+    parser.add_argument("prefix", type=str, nargs="+")
+    parser.add_argument("--since", type=parse_timestamp,
+                        help="Only include versions modified at or after this ISO 8601 time")
+    parser.add_argument("--hash-secure-strings", action="store_true",
+                        help="Replace SecureString values with their SHA-256 hash")
+    parser.add_argument("--max-workers", default=DEFAULT_MAX_WORKERS, type=int)
+    add_call_policy_arguments(parser)
+
+    args = parser.parse_args()
+    configure_call_policy(args)
+
+    history = CompileHistory(args.prefix, args.since, args.hash_secure_strings, args.max_workers)
+    try:
+        for version in history():
+            print(json.dumps(version, default=str), flush=True)
+    except (NonZeroErrorCode, NoParametersFound, CommandTimeout) as error:
+        print(repr(error))
+        sys.exit(1)
@@ -44,6 +44,9 @@ import json
 
 from subprocess import call
 
+from common import get_rate_limiter
+from helper_daemon import clear_cache
+
 
 class PutParameter:
     """An object representing a single 'aws ssm put-parameter' command.
@@ -98,6 +101,7 @@ class PutParameter:
 
     def __call__(self):
         """Run the command."""
+        get_rate_limiter().acquire("ssm", "put-parameter")
         return call(self.call_args)
 
     @classmethod
@@ -133,11 +137,16 @@ def run_commands(parameter, value, parameter_type, overwrite, input_json=None):
             )
         )
 
+    changed = False
     for command in commands:
         return_code = command()
         if return_code == 0:
+            changed = True
             print("Success! {} = {}".format(command.parameter, command.value))
 
+    if changed:
+        clear_cache()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Upload parameters to AWS Parameter Store')
@@ -1,56 +1,534 @@
-import asyncio
-import sys
+"""
+Run droidcam-cli with an icon in the system tray, which can be used to stop it.
+
+Usage:
+
+    python droidcam_cli_with_tray_icon.py [OPTIONS] <droidcam-cli arguments>
+
+    The tray icon appears as soon as droidcam-cli reports that it's connected. If droidcam-cli
+    exits, we exit with its return code.
+
+    OPTIONAL:
+
+        --ready-timeout <seconds>   - How long to wait for droidcam-cli to connect before giving
+                                      up. Defaults to 10 seconds.
+
+        --ready-pattern <regex>     - A regular expression matching the line of droidcam-cli
+                                      output which shows it's connected.
+
+        --supervise                 - Restart droidcam-cli whenever it exits or fails to connect,
+                                      e.g. when Wi-Fi drops. Restarts are delayed by an
+                                      exponential backoff with jitter. The tray menu shows whether
+                                      droidcam-cli is connecting, live or backing off, and how many
+                                      times and for how long it's been disconnected.
+
+        --min-backoff <seconds>     - The delay before the first restart. Defaults to 1 second.
+
+        --max-backoff <seconds>     - The longest delay between restarts. Defaults to 60 seconds.
+
+        --min-uptime <seconds>      - How long droidcam-cli must stay connected before the backoff
+                                      is reset. Defaults to 30 seconds.
+
+        --sample-interval <seconds> - How often to sample droidcam-cli's CPU usage, resident
+                                      memory and thread count from /proc, for display in the tray
+                                      menu and tooltip. Defaults to 5 seconds. 0 disables sampling.
+
+        --stats-csv <path>          - Append each sample to this CSV file.
+
+        --headless                  - Don't show a tray icon. The GUI libraries are never loaded.
+                                      Without pystray installed, there's no tray icon either way.
+
+    Any other arguments are passed to droidcam-cli.
+"""
+
+import argparse
+import csv
+import os
+import pty
+import random
+import re
+import selectors
 import signal
+import sys
+import termios
+import threading
 
-from PIL import Image
+from datetime import datetime
 from subprocess import Popen
-from time import sleep
+from time import monotonic
 from os.path import abspath, join, dirname
 
-try:
-    from pystray import Icon, Menu, MenuItem
-except ImportError:
-    PYSTRAY_AVAILABLE = False
-else:
-    PYSTRAY_AVAILABLE = True
-
 TRAY_ICON_TITLE = "droidcam-tray-icon"
+ICON_PATH = join(dirname(abspath(__file__)), "icon.png")
+
+DEFAULT_READY_TIMEOUT = 10
+# "Connected", but not "not connected", "disconnected" or "unconnected"
+DEFAULT_READY_PATTERN = r"(?i)^(?!.*\b(?:not\s+|dis|un)connected\b).*\bconnected\b"
+
+DEFAULT_MIN_BACKOFF = 1
+DEFAULT_MAX_BACKOFF = 60
+DEFAULT_MIN_UPTIME = 30
+
+DEFAULT_SAMPLE_INTERVAL = 5
+
+
+class DroidcamProcess:
+    """A droidcam-cli process, whose output is echoed to our own.
+
+    Its output is read through a pseudo-terminal so that it's line buffered, and we see each line
+    as soon as it's written.
+    """
+
+    command = "droidcam-cli"
+
+    def __init__(self, droidcam_args):
+        self.output, terminal = pty.openpty()
+        # Don't translate newlines written to the terminal
+        attributes = termios.tcgetattr(terminal)
+        attributes[1] &= ~termios.OPOST
+        termios.tcsetattr(terminal, termios.TCSANOW, attributes)
+        try:
+            self.process = Popen([self.command, *droidcam_args], stdout=terminal, stderr=terminal)
+        finally:
+            os.close(terminal)
+
+    def _read(self):
+        """Read and echo available output. Returns an empty string once there's no more."""
+        try:
+            data = os.read(self.output, 4096)
+        except OSError:
+            # Reading a terminal with no writers left raises EIO
+            data = b""
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+        return data
+
+    def _watch(self, pattern=None, timeout=None):
+        """Echo output until a line matches 'pattern', the process exits or 'timeout' seconds pass.
+
+        Returns True if a matching line was found. The process's exit is seen as soon as it
+        happens, without polling.
+        """
+        pattern = re.compile(pattern) if pattern is not None else None
+        deadline = monotonic() + timeout if timeout is not None else None
+        selector = selectors.DefaultSelector()
+        selector.register(self.output, selectors.EVENT_READ)
+        # Where available, a pidfd becomes readable when the process exits, even if something else
+        # still holds its output open
+        pidfd = os.pidfd_open(self.process.pid) if hasattr(os, "pidfd_open") else None
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+
+        buffered = b""
+        try:
+            while True:
+                remaining = deadline - monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                for key, _ in selector.select(remaining):
+                    if key.fd == pidfd:
+                        self.process.wait()
+                        # Echo whatever was written before it exited
+                        selector.unregister(pidfd)
+                        while selector.select(0) and self._read():
+                            pass
+                        return False
+                    data = self._read()
+                    if not data:
+                        self.process.wait()
+                        return False
+                    if pattern is None:
+                        continue
+                    *lines, buffered = (buffered + data).split(b"\n")
+                    if any(pattern.search(line.decode(errors="replace")) for line in lines):
+                        return True
+        finally:
+            selector.close()
+            if pidfd is not None:
+                os.close(pidfd)
+
+    def wait_until_ready(self, pattern, timeout):
+        """Wait for a line of output matching 'pattern'.
+
+        Returns True once it's found, or False if the process exits or 'timeout' seconds pass
+        first.
+        """
+        return self._watch(pattern, timeout)
+
+    def wait(self):
+        """Echo output until the process exits and return its return code."""
+        if self.process.returncode is None:
+            self._watch()
+        os.close(self.output)
+        return self.process.returncode
+
+    def terminate(self):
+        self.process.terminate()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+
+class Supervisor:
+    """Run droidcam-cli, optionally restarting it whenever it exits.
+
+    Restarts are delayed by an exponential backoff with jitter, which is reset once droidcam-cli
+    has stayed connected for 'min_uptime' seconds, so a connection which keeps dropping straight
+    away still backs off. The number of reconnections and the total time spent without a connection
+    are recorded. 'on_change' is called whenever the state changes.
+    """
+
+    CONNECTING = "connecting"
+    LIVE = "live"
+    BACKING_OFF = "backing off"
+    STOPPED = "stopped"
+
+    def __init__(self, droidcam_args, ready_pattern=DEFAULT_READY_PATTERN,
+                 ready_timeout=DEFAULT_READY_TIMEOUT, restart=False,
+                 min_backoff=DEFAULT_MIN_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 min_uptime=DEFAULT_MIN_UPTIME, on_change=None):
+        self.droidcam_args = droidcam_args
+        self.ready_pattern = ready_pattern
+        self.ready_timeout = ready_timeout
+        self.restart = restart
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.min_uptime = min_uptime
+        self.on_change = on_change
+
+        self.state = None
+        self.changed = threading.Condition()
+        self.stopping = threading.Event()
+        self.process = None
+        self.returncode = None
+        self.timed_out = False
+
+        self.reconnects = 0
+        self.total_downtime = 0.0
+        self.down_since = None
+
+    @property
+    def downtime(self):
+        """Total seconds spent without a connection since droidcam-cli first connected."""
+        if self.down_since is None:
+            return self.total_downtime
+        return self.total_downtime + monotonic() - self.down_since
+
+    def _set_state(self, state):
+        with self.changed:
+            self.state = state
+            self.changed.notify_all()
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def wait_for_state(self, *states):
+        with self.changed:
+            self.changed.wait_for(lambda: self.state in states)
+        return self.state
+
+    def get_backoff(self, attempt):
+        delay = min(self.max_backoff, self.min_backoff * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def _run_once(self):
+        """Run droidcam-cli until it exits.
+
+        Returns the number of seconds it was connected for, or None if it didn't connect.
+        """
+        with self.changed:
+            if self.stopping.is_set():
+                return None
+            self.process = DroidcamProcess(self.droidcam_args)
+        self._set_state(self.CONNECTING)
+
+        self.timed_out = False
+        connected = self.process.wait_until_ready(self.ready_pattern, self.ready_timeout)
+        if connected:
+            if self.down_since is not None:
+                self.total_downtime += monotonic() - self.down_since
+                self.reconnects += 1
+            self._set_state(self.LIVE)
+            live_since = monotonic()
+        elif self.process.returncode is None:
+            self.timed_out = True
+            self.process.terminate()
+
+        self.returncode = self.process.wait()
+        if not connected:
+            return None
+        self.down_since = monotonic()
+        return self.down_since - live_since
+
+    def run(self):
+        attempt = 0
+        try:
+            while not self.stopping.is_set():
+                uptime = self._run_once()
+                if uptime is not None and uptime >= self.min_uptime:
+                    attempt = 0
+                if self.stopping.is_set() or not self.restart:
+                    break
+                self._set_state(self.BACKING_OFF)
+                self.stopping.wait(self.get_backoff(attempt))
+                attempt += 1
+        finally:
+            self._set_state(self.STOPPED)
+
+    def stop(self):
+        with self.changed:
+            self.stopping.set()
+            if self.process is not None:
+                self.process.terminate()
+
+
+class ProcessStats:
+    """Sample the CPU time, resident memory and thread count of droidcam-cli.
+
+    Each sample is a single read of /proc/<pid>/stat. Samples can be appended to 'csv_path' and
+    'on_sample' is called after each one.
+    """
+
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+
+    csv_fields = ("time", "pid", "cpu_seconds", "cpu_percent", "rss_bytes", "threads")
+
+    def __init__(self, csv_path=None, on_sample=None):
+        self.csv_path = csv_path
+        self.on_sample = on_sample
+        self.latest = None
+        self._previous = None
+
+    def sample(self, pid):
+        with open("/proc/{}/stat".format(pid)) as stat_file:
+            # The command name may contain spaces, so split what follows it
+            fields = stat_file.read().rpartition(")")[2].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        now = monotonic()
+
+        cpu_percent = None
+        if self._previous is not None and self._previous[0] == pid:
+            _, previous_time, previous_cpu_seconds = self._previous
+            cpu_percent = 100 * (cpu_seconds - previous_cpu_seconds) / (now - previous_time)
+        self._previous = (pid, now, cpu_seconds)
+
+        self.latest = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "pid": pid,
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": cpu_percent,
+            "rss_bytes": int(fields[21]) * self.page_size,
+            "threads": int(fields[17]),
+        }
+        return self.latest
+
+    def describe(self):
+        if self.latest is None:
+            return "No samples"
+        cpu_percent = self.latest["cpu_percent"]
+        return "CPU {}, RSS {:.1f} MiB, {} threads".format(
+            "-" if cpu_percent is None else "{:.1f}%".format(cpu_percent),
+            self.latest["rss_bytes"] / 2 ** 20,
+            self.latest["threads"],
+        )
+
+    def _write_csv(self, csv_file):
+        writer = csv.DictWriter(csv_file, self.csv_fields)
+        if csv_file.tell() == 0:
+            writer.writeheader()
+        writer.writerow(self.latest)
+        csv_file.flush()
+
+    def run(self, supervisor, interval):
+        """Sample the supervisor's process every 'interval' seconds while it's running."""
+        csv_file = open(self.csv_path, "a", newline="") if self.csv_path else None
+        try:
+            while not supervisor.stopping.wait(interval):
+                if supervisor.state not in (Supervisor.CONNECTING, Supervisor.LIVE):
+                    continue
+                try:
+                    self.sample(supervisor.process.pid)
+                except (OSError, IndexError, ValueError):
+                    # The process exited between checking and sampling
+                    continue
+                if csv_file is not None:
+                    self._write_csv(csv_file)
+                if self.on_sample is not None:
+                    self.on_sample(self)
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+
+
+def get_exit_code(returncode):
+    """Return the exit code for a process's 'returncode', which is negative if it was killed."""
+    return 128 - returncode if returncode < 0 else returncode
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+
+
+def get_icon_cache_path():
+    """Return the path of the icon's decoded pixels, which changes whenever the icon does."""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    filename = "icon-{}.rgba".format(os.stat(ICON_PATH).st_mtime_ns)
+    return join(cache_dir, "droidcam-tray", filename)
 
 
 def get_icon_image():
-    here = abspath(__file__)
-    icon_path = join(dirname(here), "icon.png")
-    return Image.open(icon_path)
+    """Return the tray icon's image, loaded from a cache of its decoded pixels where possible.
+
+    The cache holds a '<width>x<height>' line followed by raw RGBA pixels.
+    """
+    from PIL import Image
+
+    cache_path = get_icon_cache_path()
+    try:
+        with open(cache_path, "rb") as cache_file:
+            size, pixels = cache_file.read().split(b"\n", 1)
+        width, height = map(int, size.split(b"x"))
+        return Image.frombytes("RGBA", (width, height), pixels)
+    except (OSError, ValueError):
+        pass
+
+    image = Image.open(ICON_PATH).convert("RGBA")
+    try:
+        os.makedirs(dirname(cache_path), exist_ok=True)
+        temporary_path = "{}.{}".format(cache_path, os.getpid())
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write("{}x{}\n".format(*image.size).encode() + image.tobytes())
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        pass
+    return image
+
+
+def load_tray():
+    """Import the GUI stack and load the icon image.
+
+    Returns the pystray module and the image, or None if pystray isn't available.
+    """
+    try:
+        import pystray
+    except ImportError:
+        return None
+    return pystray, get_icon_image()
 
 
-def run_tray_icon(exit_callback):
-    menu = Menu(MenuItem("Exit", exit_callback))
-    icon_image = get_icon_image()
-    icon = Icon(TRAY_ICON_TITLE, icon_image, menu=menu)
-    icon.run()
+def run_tray_icon(pystray, icon_image, supervisor, stats, exit_callback):
+    Icon, Menu, MenuItem = pystray.Icon, pystray.Menu, pystray.MenuItem
+    menu = Menu(
+        MenuItem(lambda _: "State: {}".format(supervisor.state), None, enabled=False),
+        MenuItem(lambda _: "Reconnects: {}".format(supervisor.reconnects), None, enabled=False),
+        MenuItem(lambda _: "Downtime: {}".format(format_duration(supervisor.downtime)), None,
+                 enabled=False),
+        MenuItem(lambda _: stats.describe(), None, enabled=False,
+                 visible=lambda _: stats.latest is not None),
+        MenuItem("Exit", exit_callback),
+    )
+    icon = Icon(TRAY_ICON_TITLE, icon_image, title="droidcam: live", menu=menu)
+
+    def update(*_):
+        title = "droidcam: {}".format(supervisor.state)
+        if stats.latest is not None and supervisor.state == Supervisor.LIVE:
+            title += "\n" + stats.describe()
+        icon.title = title
+        icon.update_menu()
+
+    running = threading.Event()
+
+    def on_change(supervisor):
+        if supervisor.state == Supervisor.STOPPED:
+            if running.is_set():
+                icon.stop()
+            return
+        update()
+
+    def setup(icon):
+        icon.visible = True
+        running.set()
+        # droidcam-cli may have stopped before 'on_change' was set or the icon was running
+        if supervisor.state == Supervisor.STOPPED:
+            icon.stop()
+
+    supervisor.on_change = on_change
+    stats.on_sample = update
+    icon.run(setup)
 
 
 if __name__ == "__main__":
-    droidcam_process = Popen(["droidcam-cli", *sys.argv[1:]])
+    parser = argparse.ArgumentParser(
+        description="Run droidcam-cli with an icon in the system tray", allow_abbrev=False,
+        epilog="Any other arguments are passed to droidcam-cli"
+    )
+    parser.add_argument("--ready-timeout", default=DEFAULT_READY_TIMEOUT, type=float,
+                        help="Seconds to wait for droidcam-cli to connect")
+    parser.add_argument("--ready-pattern", default=DEFAULT_READY_PATTERN,
+                        help="A regular expression matching droidcam-cli's connected message")
+    parser.add_argument("--supervise", action="store_true",
+                        help="Restart droidcam-cli whenever it exits")
+    parser.add_argument("--min-backoff", default=DEFAULT_MIN_BACKOFF, type=float,
+                        help="Seconds to wait before the first restart")
+    parser.add_argument("--max-backoff", default=DEFAULT_MAX_BACKOFF, type=float,
+                        help="The longest time to wait between restarts")
+    parser.add_argument("--min-uptime", default=DEFAULT_MIN_UPTIME, type=float,
+                        help="Seconds droidcam-cli must stay connected to reset the backoff")
+    parser.add_argument("--sample-interval", default=DEFAULT_SAMPLE_INTERVAL, type=float,
+                        help="Seconds between samples of droidcam-cli's resource usage. "
+                             "0 disables sampling")
+    parser.add_argument("--stats-csv", help="Append droidcam-cli's resource usage to this file")
+    parser.add_argument("--headless", action="store_true",
+                        help="Don't show a tray icon or load any GUI libraries")
+
+    args, droidcam_args = parser.parse_known_args()
+
+    supervisor = Supervisor(droidcam_args, args.ready_pattern, args.ready_timeout,
+                            args.supervise, args.min_backoff, args.max_backoff, args.min_uptime)
+    supervisor_thread = threading.Thread(target=supervisor.run, daemon=True)
 
     def exit_handler(*args):
-        droidcam_process.terminate()
+        supervisor.stop()
         sys.exit()
 
     signal.signal(signal.SIGTERM, exit_handler)
+    supervisor_thread.start()
+
+    # Load the GUI stack while droidcam-cli connects, rather than before starting it
+    tray = []
+    tray_loader = threading.Thread(target=lambda: tray.append(load_tray()), daemon=True)
+    if not args.headless:
+        tray_loader.start()
+
+    stats = ProcessStats(args.stats_csv)
+    # Samples are only used by the tray icon and CSV file
+    if args.sample_interval > 0 and (not args.headless or args.stats_csv):
+        threading.Thread(
+            target=stats.run, args=(supervisor, args.sample_interval), daemon=True
+        ).start()
+
+    # When supervising, startup failures are retried like any other exit
+    if supervisor.wait_for_state(Supervisor.LIVE, Supervisor.STOPPED) == Supervisor.STOPPED:
+        if supervisor.timed_out:
+            print("droidcam-cli didn't connect within {} seconds".format(args.ready_timeout),
+                  file=sys.stderr)
+            sys.exit(1)
+        sys.exit(get_exit_code(supervisor.returncode))
+
+    if not args.headless:
+        tray_loader.join()
+        if tray and tray[0] is not None:
+            pystray, icon_image = tray[0]
+            run_tray_icon(pystray, icon_image, supervisor, stats,
+                          lambda icon: (supervisor.stop(), icon.stop()))
+    supervisor_thread.join()
 
-    # Wait a second before checking if we've terminated early
-    # due to bad arguments or similar
-    sleep(0.5)
-    droidcam_returncode = droidcam_process.poll()
-
-    if not droidcam_returncode:
-
-        if PYSTRAY_AVAILABLE:
-            run_tray_icon(exit_handler)
-        else:
-            loop = asyncio.get_event_loop()
-            try:
-                loop.run_forever()
-            finally:
-                loop.close()
+    if not supervisor.stopping.is_set():
+        sys.exit(get_exit_code(supervisor.returncode))
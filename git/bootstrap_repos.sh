@@ -16,22 +16,39 @@
 # In the directory into which you'd like to clone the repos, run the script with a path to your
 # repos file. This file should be a text file with a number of lines of the form:
 #
-# <Repo URL> <Directory to clone into> (<Name of venv to create>) (<Python version>)
-#                                                 ^ Optional       ^ Optional
+# <Repo URL> <Directory to clone into> (<Name of venv to create>) (<Python version>) (<Options>)
+#                                                 ^ Optional       ^ Optional         ^ Optional
 # Lines starting with "#" are ignored.
 #
+# Options are any words beginning with "--", which are passed to 'git clone' for that repo. For
+# example, '--filter=blob:none' for a partial clone or '--depth=1' for a shallow clone. Values
+# must be joined to their option with "=".
+#
 # For each line in the repos file, we then:
 #    1. Clone the specified repo into the given directory, if it doesn't already exist
 #    2. Create a venv with the given name, if one doesn't already exist
 #    3. Install python dependencies listed in requirements.txt file in each repo directory
 #
+# Step 3 is skipped if the requirements files, setup.py and the venv's python version are unchanged
+# since the last successful install into that venv. A hash of these is stored in the venv to check.
+#
+# Pass '-j <jobs>' to bootstrap that many repos at once. Each repo's output is printed in one
+# block once it's finished. Repos sharing a venv are never installed into it at the same time.
+# A lock left on a venv by a bootstrap which was killed is broken once its process has gone.
+#
+# Clone options can also be set for every repo, before those set in the repos file:
+#
+#    --partial            Clone without file contents, fetching them on demand (--filter=blob:none)
+#    --depth <depth>      Clone only the last <depth> commits
+#    --single-branch      Clone only the remote's default branch
+#    --reference <repo>   Borrow objects from a local repo shared by every clone, if it exists.
+#                         Clones depend on the reference repo, so it mustn't be deleted.
+#
 # The commands for each of these steps can be modified for your system in the block below.
 
 INITIAL_ENV_PACKAGES="ipython"
 # =================================================================================================
 
-EXISTING_ENVS=$(ls -d "$VENV_DIR"/*/)
-
 
 echo_highlight () {
   HIGHLIGHT="\033[1;92m"
@@ -40,11 +57,58 @@ echo_highlight () {
 }
 
 
+sha256 () {
+    if [[ -n $(which "sha256sum" 2>/dev/null) ]]; then
+        sha256sum | cut -d' ' -f1
+    else
+        shasum -a 256 | cut -d' ' -f1
+    fi
+}
+
+
+# Print a hash of everything which determines what gets installed into the venv for a repo, given
+# the venv's python. Its exact version is used, since "3.11" may resolve to a newer patch release
+requirements_hash () {
+    venv_python_version=$("$1" --version 2>&1) || return
+    (
+        echo "$venv_python_version $INITIAL_ENV_PACKAGES $PIP_EXTRA_INDEX_URL"
+        reqs_files=$(find . -maxdepth 2 -name "requirements*.txt" -type f | sort)
+        for reqs_file in $reqs_files setup.py; do
+            if [[ -e "$reqs_file" ]]; then
+                echo "$reqs_file"
+                cat "$reqs_file"
+            fi
+        done
+    ) | sha256
+}
+
+
+# A lock is stale if its owner has exited, or it's had no owner for over a minute. A lock is
+# briefly ownerless while it's being taken
+venv_lock_is_stale () {
+    lock_pid=$(cat "$1/pid" 2>/dev/null)
+    if [[ -n $lock_pid ]]; then
+        ! kill -0 "$lock_pid" 2>/dev/null
+    else
+        [[ -n $(find "$1" -maxdepth 0 -mmin +1 2>/dev/null) ]]
+    fi
+}
+
+
 bootstrap () {
-    repo_url=$1
-    repo_dir=$2
-    venv_name=$3
-    python_version=$4
+    local words=() clone_args=("${BOOTSTRAP_CLONE_ARGS[@]}") waiting=
+    for word in "$@"; do
+        if [[ $word == --* ]]; then
+            clone_args+=("$word")
+        else
+            words+=("$word")
+        fi
+    done
+
+    repo_url=${words[0]}
+    repo_dir=${words[1]}
+    venv_name=${words[2]}
+    python_version=${words[3]}
 
     if [[ -z $(which "uv" 2>/dev/null) ]]; then
         echo_highlight "uv not found. Exiting..."
@@ -58,7 +122,7 @@ bootstrap () {
 
     if [[ ! -d "$PWD/$repo_dir" ]]; then
         echo_highlight "Cloning $repo_dir..."
-        git clone "$repo_url" "$repo_dir"
+        git clone "${clone_args[@]}" "$repo_url" "$repo_dir"
     else
         echo_highlight "Repo directory already exists: $repo_dir..."
     fi
@@ -68,7 +132,30 @@ bootstrap () {
         return
     fi
 
-    if grep -q "$venv_name" <<< $EXISTING_ENVS; then
+    # Only one repo may create or install into a venv at once. The lock holds the PID of its owner,
+    # so a lock left behind by a process which was killed can be broken
+    venv_lock="$VENV_DIR/.$venv_name.lock"
+    until mkdir "$venv_lock" 2>/dev/null; do
+        # Only one repo at a time may break the lock, checking it again first, so a lock just
+        # taken by another repo isn't broken too
+        if venv_lock_is_stale "$venv_lock" && mkdir "$venv_lock.break" 2>/dev/null; then
+            if venv_lock_is_stale "$venv_lock"; then
+                echo_highlight "Breaking stale lock on $venv_name..."
+                rm -rf "$venv_lock"
+            fi
+            rmdir "$venv_lock.break"
+            continue
+        fi
+        if [[ -z $waiting ]]; then
+            echo_highlight "Waiting for another repo to finish with $venv_name..."
+            waiting=yes
+        fi
+        sleep 0.2
+    done
+    echo "${BASHPID:-$$}" > "$venv_lock/pid"
+    trap 'rm -rf "$venv_lock"' EXIT
+
+    if [[ -d "$VENV_DIR/$venv_name" ]]; then
         echo_highlight "Virtual environment already exists: $venv_name..."
     else
         echo_highlight "Creating virtual environment: $venv_name..."
@@ -77,27 +164,71 @@ bootstrap () {
 
     (
         cd "$repo_dir" &&
+        hash_file="$VENV_DIR/$venv_name/.bootstrap-$(echo "$repo_dir" | tr '/' '_').sha256" &&
+        reqs_hash=$(requirements_hash "$VENV_DIR/$venv_name/bin/python") &&
+        if [[ "$(cat "$hash_file" 2>/dev/null)" == "$reqs_hash" ]]; then
+            echo_highlight "Requirements unchanged for $repo_dir. Skipping install..."
+            exit
+        fi &&
         source "$VENV_DIR/$venv_name/bin/activate" &&
         for reqs_file in $(find . -maxdepth 2 -name "requirements*.txt" -type f 2>/dev/null); do
             echo_highlight "Installing python requirements for $reqs_file..."
-            uv pip install --extra-index-url "$PIP_EXTRA_INDEX_URL" -r "$reqs_file"
-        done
-        uv pip install "$INITIAL_ENV_PACKAGES"
+            uv pip install --extra-index-url "$PIP_EXTRA_INDEX_URL" -r "$reqs_file" || exit
+        done &&
+        uv pip install "$INITIAL_ENV_PACKAGES" &&
         if [[ -e "setup.py" ]]; then
             echo_highlight "Detected $repo_dir is a python package. Installing editable..."
             uv pip install --extra-index-url "$PIP_EXTRA_INDEX_URL" --editable .
-        fi
-        deactivate
+        fi &&
+        echo "$reqs_hash" > "$hash_file"
     )
 }
 
-if [[ $1 == "-h" ]] || [[ $1 == "--help" ]]; then
-    echo "Usage: bootstrap_repos /path/to/repos.txt"
-    return
-fi
+bootstrap_job () {
+    bootstrap "$@" 2>&1
+}
+
+bootstrap_print () {
+    cat "$1.out"
+}
 
-cat $1 | grep "^[^#]" | while read line; do
-    bootstrap $line
+BOOTSTRAP_JOBS=1
+BOOTSTRAP_CLONE_ARGS=()
+while [[ $# -gt 0 ]]; do
+    case $1 in
+        -h|--help)
+            echo "Usage: bootstrap_repos [-j JOBS] [--partial] [--depth DEPTH] [--single-branch]"
+            echo "                       [--reference REPO] /path/to/repos.txt"
+            return ;;
+        --partial)
+            BOOTSTRAP_CLONE_ARGS+=(--filter=blob:none)
+            shift ;;
+        --depth)
+            BOOTSTRAP_CLONE_ARGS+=("--depth=$2")
+            shift 2 ;;
+        --single-branch)
+            BOOTSTRAP_CLONE_ARGS+=(--single-branch)
+            shift ;;
+        --reference)
+            BOOTSTRAP_CLONE_ARGS+=("--reference-if-able=$2")
+            shift 2 ;;
+        -j)
+            BOOTSTRAP_JOBS=$2
+            shift 2 ;;
+        -j*)
+            BOOTSTRAP_JOBS=${1#-j}
+            shift ;;
+        *)
+            break ;;
+    esac
 done
 
+. parallel.sh
+
+BOOTSTRAP_TMP=$(mktemp -d)
+
+grep "^[^#]" "$1" | parallel_run "$BOOTSTRAP_JOBS" "$BOOTSTRAP_TMP" bootstrap_job bootstrap_print
+
+rm -rf "$BOOTSTRAP_TMP"
+
 echo_highlight "All done!"
@@ -16,7 +16,12 @@
 # Lines starting with "#" are ignored.
 #
 # For each line in the repos file, we check if there are uncommitted changes for that repo.
-# If the index is clean, we checkout master and pull from the remote.
+# If the index is clean, we checkout master and pull from the remote. If the remote's default
+# branch hasn't moved since the last fetch, which we check with a single 'git ls-remote', we skip
+# fetching and fast-forward from the local copy of the remote branch instead.
+#
+# Pass '-j <jobs>' to update that many repos at once. Each repo's output is printed in one block
+# once it's finished, followed by a summary of updated, unchanged, skipped and failed repos.
 #
 # =================================================================================================
 
@@ -27,31 +32,75 @@ comp () {
 
     if [ ! -d "$PWD/$repo_dir" ]; then
         echo "Repo directory does not exist: $repo_dir..."
-        return
+        return 3
     fi
 
     (
-        cd "$repo_dir"
+        cd "$repo_dir" || exit 1
         if git diff-index --quiet HEAD; then
             default_branch=$(git rev-parse --abbrev-ref origin/HEAD | cut -d'/' -f2)
+            remote_ref=$(git ls-remote origin "refs/heads/$default_branch") || exit 1
+            remote_sha=$(echo "$remote_ref" | cut -f1)
+            local_sha=$(git rev-parse --verify -q "refs/remotes/origin/$default_branch")
+            if [ -n "$remote_sha" ] && [ "$remote_sha" = "$local_sha" ]; then
+                echo "$repo_dir is clean. origin/$default_branch is unchanged, skipping fetch..."
+                git checkout "$default_branch" &&
+                    git merge --ff-only "origin/$default_branch" || exit 1
+                exit 4
+            fi
             echo "$repo_dir is clean. Updating $default_branch..."
-            git fetch
-            git checkout "$default_branch"
-            git pull
+            git fetch && git checkout "$default_branch" && git pull || exit 1
         else
             echo "$repo_dir is dirty. Skipping..."
+            exit 2
         fi
     )
 }
 
-if [ $1 = "-h" -o $1 = "--help" ]; then
-    echo "Usage: codp /path/to/repos.txt"
-    return
-fi
+comp_job () {
+    comp "$@" 2>&1
+}
+
+comp_print () {
+    cat "$1.out"
+}
+
+comp_summary () {
+    for comp_status in 0:Updated 4:Unchanged 2:Skipped-dirty 3:Missing 1:Failed; do
+        comp_repos=$(grep -l "^${comp_status%%:*}\$" "$1"/*.status 2>/dev/null |
+            while read -r status_file; do cat "${status_file%.status}.repo"; done)
+        if [ -n "$comp_repos" ]; then
+            echo "${comp_status#*:}:"
+            echo "$comp_repos" | sed "s/^/    /"
+        fi
+    done
+}
 
-cat $1 | grep "^[^#]" | while read line; do
-    comp $line
+comp_jobs=1
+while [ $# -gt 0 ]; do
+    case $1 in
+        -h|--help)
+            echo "Usage: codp [-j JOBS] /path/to/repos.txt"
+            return ;;
+        -j)
+            comp_jobs=$2
+            shift 2 ;;
+        -j*)
+            comp_jobs=${1#-j}
+            shift ;;
+        *)
+            break ;;
+    esac
 done
 
+. parallel.sh
+
+comp_tmp=$(mktemp -d)
+
+grep "^[^#]" "$1" | parallel_run "$comp_jobs" "$comp_tmp" comp_job comp_print
+
+echo
+comp_summary "$comp_tmp"
+rm -rf "$comp_tmp"
 
 echo "All done!"
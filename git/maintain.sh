@@ -0,0 +1,155 @@
+#!/bin/sh
+#
+# =================================================================================================
+#
+# maintain
+#
+# A script for keeping large repos described by a repos file quick to work with.
+#
+# Usage:
+#
+# In the directory containing your repos, run the script with a path to your repos file.
+# This file should be a text file with a number of lines of the form:
+#
+# <Repo URL> <Directory to clone into> (<Name of conda environment to create>)
+#                                                 ^ Optional
+# Lines starting with "#" are ignored.
+#
+# For each line in the repos file, we run git's commit-graph, prefetch, loose-objects and
+# incremental-repack maintenance tasks, then print a table of the time taken and the disk space
+# saved for each repo. Repos which were maintained more recently than the interval are skipped.
+#
+# Pass '-j <jobs>' to maintain that many repos at once (default 4), '-i <hours>' to set the
+# interval (default 24) and '-f' to maintain every repo regardless of when it was last maintained.
+#
+# Requires git 2.30 or above.
+#
+# =================================================================================================
+
+
+maintain () {
+    repo_url=$1
+    repo_dir=$2
+
+    if [ ! -d "$PWD/$repo_dir" ]; then
+        printf "%s\tmissing\n" "$repo_dir"
+        return 3
+    fi
+
+    (
+        cd "$repo_dir" || exit 1
+        git_dir=$(git rev-parse --absolute-git-dir) || exit 1
+        timestamp_file="$git_dir/maintain.timestamp"
+        now=$(date +%s)
+        last_run=$(cat "$timestamp_file" 2>/dev/null || echo 0)
+        if [ "$maintain_force" != "yes" ] &&
+                [ $((now - last_run)) -lt $((maintain_interval * 3600)) ]; then
+            printf "%s\tskipped\n" "$repo_dir"
+            exit 4
+        fi
+
+        size_before=$(du -sk "$git_dir" | cut -f1)
+        git maintenance run --quiet --task=commit-graph --task=prefetch \
+            --task=loose-objects > /dev/null || exit 1
+        # A repo whose objects are all loose has no packs to repack, which isn't a failure
+        if ! repack_errors=$(git maintenance run --quiet --task=incremental-repack 2>&1 \
+                > /dev/null); then
+            case $repack_errors in
+                *"no pack files to index"*) ;;
+                *) echo "$repack_errors" >&2; exit 1 ;;
+            esac
+        elif [ -n "$repack_errors" ]; then
+            echo "$repack_errors" >&2
+        fi
+        size_after=$(du -sk "$git_dir" | cut -f1)
+        echo "$now" > "$timestamp_file"
+        printf "%s\tmaintained\t%s\t%s\t%s\n" "$repo_dir" $(($(date +%s) - now)) \
+            "$size_before" "$size_after"
+    )
+}
+
+maintain_job () {
+    maintain_line=$(maintain "$@")
+    if [ -n "$maintain_line" ]; then
+        echo "$maintain_line"
+    else
+        printf "%s\tfailed\n" "$2"
+    fi
+}
+
+maintain_print () {
+    if [ -s "$1.err" ]; then
+        echo "$(cat "$1.repo"):"
+        sed "s/^/    /" "$1.err"
+    fi
+}
+
+maintain_table () {
+    awk -F '\t' '
+        BEGIN { seconds = 0; saved = 0 }
+        function format_size(kilobytes) {
+            if (kilobytes < 0) { return "-" format_size(-kilobytes) }
+            if (kilobytes >= 1048576) { return sprintf("%.1fG", kilobytes / 1048576) }
+            if (kilobytes >= 1024) { return sprintf("%.1fM", kilobytes / 1024) }
+            return kilobytes "K"
+        }
+        {
+            if ($2 == "maintained") {
+                row[NR] = $1 "\t" $3 "s\t" format_size($4) "\t" format_size($4 - $5) "\t" $2
+                seconds += $3
+                saved += $4 - $5
+            } else {
+                row[NR] = $1 "\t-\t-\t-\t" $2
+            }
+            if (length($1) > width) { width = length($1) }
+        }
+        END {
+            if (width < 5) { width = 5 }
+            format = "%-" width "s  %6s  %8s  %8s  %s\n"
+            printf format, "REPO", "TIME", "SIZE", "SAVED", "STATUS"
+            for (line = 1; line <= NR; line++) {
+                split(row[line], cells, "\t")
+                printf format, cells[1], cells[2], cells[3], cells[4], cells[5]
+            }
+            printf "%-" width "s  %6s  %8s  %8s\n", "Total", seconds "s", "", format_size(saved)
+        }'
+}
+
+maintain_jobs=4
+maintain_interval=24
+maintain_force=no
+while [ $# -gt 0 ]; do
+    case $1 in
+        -h|--help)
+            echo "Usage: maintain [-j JOBS] [-i HOURS] [-f] /path/to/repos.txt"
+            return ;;
+        -j)
+            maintain_jobs=$2
+            shift 2 ;;
+        -j*)
+            maintain_jobs=${1#-j}
+            shift ;;
+        -i)
+            maintain_interval=$2
+            shift 2 ;;
+        -i*)
+            maintain_interval=${1#-i}
+            shift ;;
+        -f)
+            maintain_force=yes
+            shift ;;
+        *)
+            break ;;
+    esac
+done
+
+. parallel.sh
+
+maintain_tmp=$(mktemp -d)
+
+grep "^[^#]" "$1" | parallel_run "$maintain_jobs" "$maintain_tmp" maintain_job maintain_print
+
+# Print repos in the order they appear in the repos file
+parallel_cat "$maintain_tmp" | maintain_table
+
+rm -rf "$maintain_tmp"
@@ -0,0 +1,84 @@
+#!/bin/sh
+#
+# =================================================================================================
+#
+# parallel
+#
+# Helpers shared by the scripts which run a command for every repo in a repos file. Sourced by
+# those scripts, so it must live alongside them on your PATH.
+#
+# Usage:
+#
+#    grep "^[^#]" /path/to/repos.txt | parallel_run <jobs> <directory> <command> (<on_done>)
+#
+# Runs '<command> <words of line>' for each line read, with at most <jobs> running at once. Each
+# runs in a subshell, so may 'exit', with STDIN from /dev/null. <jobs> must be a positive integer.
+# For the Nth line, in <directory>:
+#
+#    N.repo      The line's second word, the repo's directory
+#    N.out       The command's STDOUT
+#    N.err       The command's STDERR
+#    N.status    The command's exit status
+#
+# Once a command finishes, '<on_done> <directory>/N' is run, if given. Only one runs at a time, so
+# it can print a repo's output without interleaving it with another's.
+#
+#    parallel_cat <directory>
+#
+# Prints every N.out in the order the lines were read.
+#
+# =================================================================================================
+
+
+parallel_run () {
+    parallel_jobs=$1
+    parallel_dir=$2
+    parallel_command=$3
+    parallel_on_done=$4
+
+    case $parallel_jobs in
+        ''|*[!0-9]*|0)
+            echo "The number of jobs must be a positive integer: '$parallel_jobs'" >&2
+            return 1 ;;
+    esac
+
+    # A FIFO holding one token per job slot, bounding the number of commands run at once
+    mkfifo "$parallel_dir/slots"
+    exec 3<>"$parallel_dir/slots"
+    parallel_slot=0
+    while [ $parallel_slot -lt "$parallel_jobs" ]; do
+        echo >&3
+        parallel_slot=$((parallel_slot + 1))
+    done
+
+    parallel_index=0
+    while read -r parallel_line; do
+        read -r _ <&3
+        parallel_index=$((parallel_index + 1))
+        (
+            parallel_output="$parallel_dir/$parallel_index"
+            set -- $parallel_line
+            echo "$2" > "$parallel_output.repo"
+            # Commands mustn't read the remaining lines of the repos file
+            ( "$parallel_command" "$@" ) < /dev/null > "$parallel_output.out" \
+                2> "$parallel_output.err"
+            echo $? > "$parallel_output.status"
+            if [ -n "$parallel_on_done" ]; then
+                until mkdir "$parallel_dir/print.lock" 2>/dev/null; do sleep 0.1; done
+                "$parallel_on_done" "$parallel_output"
+                rmdir "$parallel_dir/print.lock"
+            fi
+            echo >&3
+        ) &
+    done
+    wait
+    exec 3>&-
+}
+
+parallel_cat () {
+    parallel_index=1
+    while [ -e "$1/$parallel_index.status" ]; do
+        cat "$1/$parallel_index.out"
+        parallel_index=$((parallel_index + 1))
+    done
+}
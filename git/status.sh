@@ -0,0 +1,169 @@
+#!/bin/sh
+#
+# =================================================================================================
+#
+# status
+#
+# A script for showing the state of every repo described by a repos file at a glance.
+#
+# Usage:
+#
+# In the directory containing your repos, run the script with a path to your repos file.
+# This file should be a text file with a number of lines of the form:
+#
+# <Repo URL> <Directory to clone into> (<Name of conda environment to create>)
+#                                                 ^ Optional
+# Lines starting with "#" are ignored.
+#
+# For each line in the repos file, we run a single 'git status --porcelain=v2 --branch' and print
+# a table of each repo's branch, commits ahead of and behind its upstream, and numbers of changed,
+# untracked and conflicted files. Repos which aren't on their default branch are marked.
+#
+# The untracked cache is used for every repo, and git's built-in file system monitor where it's
+# supported (git 2.36 or above, on macOS and Windows), so repeated runs on large working trees are
+# quick. The monitor starts a daemon for each repo which keeps running in the background after
+# the script finishes. Stop one with 'git fsmonitor--daemon stop' in that repo. Repos with
+# 'core.fsmonitor' set keep their own setting.
+#
+# Pass '-j <jobs>' to query that many repos at once (default 8) and '--json' to print one JSON
+# object per repo instead of a table.
+#
+# =================================================================================================
+
+
+repo_status () {
+    repo_url=$1
+    repo_dir=$2
+
+    if [ ! -d "$PWD/$repo_dir" ]; then
+        printf "%s\tmissing\n" "$repo_dir"
+        return 3
+    fi
+
+    (
+        cd "$repo_dir" || exit 1
+        set -- -c core.untrackedCache=true
+        # Exits with 128 where the built-in monitor isn't supported. Keep any configured monitor
+        if [ "$repo_status_fsmonitor" = "yes" ] && [ -z "$(git config core.fsmonitor)" ]; then
+            git fsmonitor--daemon status >/dev/null 2>&1
+            if [ $? -ne 128 ]; then
+                set -- "$@" -c core.fsmonitor=true
+            fi
+        fi
+        default_branch=$(git rev-parse --abbrev-ref origin/HEAD 2>/dev/null | cut -d'/' -f2)
+        porcelain=$(git "$@" status --porcelain=v2 --branch) || exit 1
+        echo "$porcelain" | awk -v repo="$repo_dir" -v default="$default_branch" '
+            $2 == "branch.head" { branch = $3 }
+            $2 == "branch.upstream" { upstream = $3 }
+            $2 == "branch.ab" { ahead = substr($3, 2); behind = substr($4, 2) }
+            $1 == "1" || $1 == "2" { changed++ }
+            $1 == "u" { conflicted++ }
+            $1 == "?" { untracked++ }
+            END {
+                if (upstream == "") { ahead = "-"; behind = "-" }
+                other = (default != "" && branch != default) ? "yes" : "no"
+                printf "%s\tok\t%s\t%s\t%s\t%s\t%d\t%d\t%d\n", repo, branch, other, ahead, behind,
+                    changed, untracked, conflicted
+            }'
+    )
+}
+
+repo_status_job () {
+    repo_status_line=$(repo_status "$@" 2>/dev/null)
+    if [ -n "$repo_status_line" ]; then
+        echo "$repo_status_line"
+    else
+        printf "%s\tfailed\n" "$2"
+    fi
+}
+
+repo_status_table () {
+    awk -F '\t' '
+        BEGIN { split("REPO BRANCH AHEAD BEHIND CHANGED UNTRACKED CONFLICTS", header, " ") }
+        $2 == "ok" {
+            row[NR] = $1 "\t" (($4 == "yes") ? $3 "*" : $3) "\t" $5 "\t" $6 "\t" $7 "\t" $8 "\t" $9
+            next
+        }
+        { row[NR] = $1 "\t(" $2 ")" }
+        END {
+            for (column = 1; column <= 7; column++) {
+                width[column] = length(header[column])
+            }
+            for (line = 1; line <= NR; line++) {
+                columns = split(row[line], cells, "\t")
+                for (column = 1; column <= columns; column++) {
+                    if (length(cells[column]) > width[column]) {
+                        width[column] = length(cells[column])
+                    }
+                }
+            }
+            for (line = 0; line <= NR; line++) {
+                if (line == 0) {
+                    columns = 7
+                    for (column = 1; column <= 7; column++) { cells[column] = header[column] }
+                } else {
+                    columns = split(row[line], cells, "\t")
+                }
+                for (column = 1; column < columns; column++) {
+                    printf "%-" width[column] "s  ", cells[column]
+                }
+                print cells[columns]
+            }
+        }'
+}
+
+repo_status_json () {
+    sed 's/[\\"]/\\&/g' | awk -F '\t' '
+        $2 == "ok" {
+            printf "{\"repo\": \"%s\", \"state\": \"ok\", \"branch\": \"%s\", ", $1, $3
+            printf "\"default_branch\": %s, ", ($4 == "yes") ? "false" : "true"
+            printf "\"ahead\": %s, \"behind\": %s, ", ($5 == "-") ? "null" : $5,
+                ($6 == "-") ? "null" : $6
+            printf "\"changed\": %s, \"untracked\": %s, \"conflicts\": %s}\n", $7, $8, $9
+            next
+        }
+        { printf "{\"repo\": \"%s\", \"state\": \"%s\"}\n", $1, $2 }'
+}
+
+repo_status_jobs=8
+repo_status_format=table
+while [ $# -gt 0 ]; do
+    case $1 in
+        -h|--help)
+            echo "Usage: status [-j JOBS] [--json] /path/to/repos.txt"
+            return ;;
+        -j)
+            repo_status_jobs=$2
+            shift 2 ;;
+        -j*)
+            repo_status_jobs=${1#-j}
+            shift ;;
+        --json)
+            repo_status_format=json
+            shift ;;
+        *)
+            break ;;
+    esac
+done
+
+. parallel.sh
+
+# Older versions of git don't have the built-in monitor, and would run a 'core.fsmonitor' of
+# 'true' as a hook instead
+repo_status_fsmonitor=$(git version | awk '{
+    split($3, version, ".")
+    print (version[1] > 2 || (version[1] == 2 && version[2] >= 36)) ? "yes" : "no"
+}')
+
+repo_status_tmp=$(mktemp -d)
+
+grep "^[^#]" "$1" | parallel_run "$repo_status_jobs" "$repo_status_tmp" repo_status_job
+
+# Print repos in the order they appear in the repos file
+parallel_cat "$repo_status_tmp" | if [ "$repo_status_format" = "json" ]; then
+    repo_status_json
+else
+    repo_status_table
+fi
+
+rm -rf "$repo_status_tmp"
@@ -1,11 +1,19 @@
 import json
+import os
 
 from functools import wraps
-from subprocess import PIPE
+from io import StringIO
+from tempfile import TemporaryDirectory
+from time import monotonic
+from subprocess import PIPE, TimeoutExpired
 from unittest import TestCase
 from unittest.mock import patch, Mock, PropertyMock, call
 
-from common import BaseCommand, BasePaginatedCommand, NonZeroErrorCode
+from common import (
+    DEFAULT_RATE_LIMITS, BaseCommand, BasePaginatedCommand, CallPolicy, CommandTimeout,
+    NonZeroErrorCode, RateLimiter, ResultCache, Target, current_target, get_targets,
+    map_concurrently, map_targets, use_target
+)
 
 
 def get_mock_response(return_code, response_bytes):
@@ -24,7 +32,8 @@ def patch_run(return_code=0, json_bytes_response=None):
         @wraps(func)
         @patch("common.run", return_value=mock_response)
         def patched(*args, **kwargs):
-            func(*args, **kwargs)
+            with patch.object(RateLimiter, "acquire", return_value=0.0):
+                func(*args, **kwargs)
         return patched
     return decorator
 
@@ -70,6 +79,224 @@ class TestBaseCommand(TestCase):
             BaseCommand()
         )
 
+    @patch.object(BaseCommand, "call_args", ["foo"])
+    @patch_run()
+    def test_call_target(self, mock_run):
+        """Calling the command within a target appends the target's CLI arguments."""
+        with use_target(Target(region="bar", profile="baz")):
+            BaseCommand()()
+        self.assertEqual(
+            mock_run.call_args_list,
+            [call(["foo", "--profile", "baz", "--region", "bar"], stdout=PIPE)]
+        )
+
+    @patch.object(BaseCommand, "call_args", ["foo"])
+    @patch.object(BaseCommand, "cache_ttl", 60)
+    @patch_run(json_bytes_response=json_bytes_response)
+    def test_call_cached(self, mock_run):
+        """Commands with a 'cache_ttl' are answered from an installed cache."""
+        with patch.object(BaseCommand, "cache", ResultCache()):
+            self.assertEqual(BaseCommand()(), self.response_dict)
+            self.assertEqual(BaseCommand()(), self.response_dict)
+            self.assertEqual(BaseCommand.cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+        self.assertEqual(mock_run.call_count, 1)
+
+
+class TestResultCache(TestCase):
+
+    @patch("common.monotonic", side_effect=[0, 5, 11])
+    def test_cache_expiry(self, _):
+        """Cached output expires after its TTL."""
+        cache = ResultCache()
+        cache.set(["foo"], "bar", 10)
+        self.assertEqual(cache.get(["foo"]), "bar")
+        self.assertIsNone(cache.get(["foo"]))
+
+
+class TestCallPolicy(TestCase):
+
+    class DummyReadCommand(BaseCommand):
+
+        base_command = "aws ssm get-parameters"
+
+        def __init__(self, call_args):
+            self._call_args = call_args
+
+        @property
+        def call_args(self):
+            return self._call_args
+
+    def setUp(self):
+        patcher = patch.object(RateLimiter, "acquire", return_value=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("common.call_policy", CallPolicy(timeout=5))
+    @patch("common.run", side_effect=TimeoutExpired(["foo"], 5))
+    def test_timeout(self, mock_run):
+        """Commands are run with the configured timeout."""
+        with self.assertRaisesRegex(CommandTimeout, "timed out"):
+            self.DummyReadCommand(["foo"])()
+        self.assertEqual(mock_run.call_args_list, [call(["foo"], stdout=PIPE, timeout=5)])
+
+    @patch("common.run")
+    def test_deadline(self, mock_run):
+        """No further commands are run once the deadline has passed."""
+        with patch("common.call_policy", CallPolicy(deadline=-1)):
+            with self.assertRaisesRegex(CommandTimeout, "Deadline exceeded"):
+                self.DummyReadCommand(["foo"])()
+        mock_run.assert_not_called()
+
+    def test_hedge_after(self):
+        """The hedging threshold is the observed p95 once there are enough samples."""
+        policy = CallPolicy(hedge=True)
+        self.assertEqual(policy.get_hedge_after("foo"), CallPolicy.default_hedge_after)
+        for latency in range(100):
+            policy.record("foo", latency)
+        self.assertEqual(policy.get_hedge_after("foo"), 95)
+
+    def test_shared_latencies(self):
+        """Latencies recorded by one process are used by others sharing the directory."""
+        with TemporaryDirectory() as directory:
+            directory = os.path.join(directory, "latencies")
+            recorder = CallPolicy(hedge=True, directory=directory)
+            for latency in range(100):
+                recorder.record(("ssm", "get-parameters"), latency)
+            CallPolicy(directory=directory).record(("ssm", "describe-parameters"), 1.0)
+            policy = CallPolicy(hedge=True, directory=directory)
+            self.assertEqual(policy.get_hedge_after(("ssm", "get-parameters")), 95)
+            self.assertEqual(policy.get_hedge_after(("ssm", "describe-parameters")),
+                             CallPolicy.default_hedge_after)
+            self.assertEqual(os.listdir(directory), ["ssm.get-parameters"])
+
+    def test_shared_latencies_unwritable(self):
+        """A latency which can't be shared is still recorded in memory."""
+        with TemporaryDirectory() as directory:
+            os.chmod(directory, 0o755)
+            policy = CallPolicy(hedge=True, directory=os.path.join(directory, "latencies"))
+            with patch("common.os.getuid", return_value=os.getuid() + 1):
+                policy.record(("ssm", "get-parameters"), 1.0)
+                self.assertEqual(policy.get_latencies(("ssm", "get-parameters")), [1.0])
+
+    def test_hedged(self):
+        """A slow command is repeated and the faster result is used."""
+        with TemporaryDirectory() as directory:
+            # Only the first process to create the lock directory is slow
+            script = 'mkdir "{}" 2>/dev/null && sleep 10; echo \'{{"foo": "bar"}}\''.format(
+                os.path.join(directory, "lock")
+            )
+            command = self.DummyReadCommand(["sh", "-c", script])
+            started = monotonic()
+            with patch("common.call_policy", CallPolicy(hedge=True, hedge_after=0.2)):
+                self.assertEqual(command(), {"foo": "bar"})
+            self.assertLess(monotonic() - started, 5)
+
+    def test_hedged_timeout(self):
+        """Hedged commands still respect the timeout."""
+        command = self.DummyReadCommand(["sleep", "10"])
+        with patch("common.call_policy", CallPolicy(timeout=0.5, hedge=True, hedge_after=0.1)):
+            with self.assertRaisesRegex(CommandTimeout, "timed out"):
+                command()
+
+
+class TestRateLimiter(TestCase):
+
+    rates = {"ssm": 2, "ssm.get-parameters": 0}
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.limiter = RateLimiter(self.rates, directory.name)
+
+    @patch("common.sleep")
+    @patch("common.time", return_value=100.0)
+    def test_acquire(self, _, mock_sleep):
+        """Calls beyond the bucket's capacity wait until a token would be available."""
+        waits = [self.limiter.acquire("ssm", "describe-parameters") for _ in range(4)]
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0])
+        self.assertEqual(mock_sleep.call_args_list, [call(0.5), call(1.0)])
+        self.assertEqual(self.limiter.stats(), {"ssm": {"calls": 4, "wait_seconds": 1.5}})
+
+    @patch("common.sleep")
+    @patch("common.time", side_effect=[100.0, 100.0, 100.0, 101.0])
+    def test_refill(self, _, mock_sleep):
+        """Tokens are replenished at the configured rate."""
+        waits = [self.limiter.acquire("ssm", "put-parameter") for _ in range(3)]
+        self.assertEqual(waits, [0.0, 0.0, 0.0])
+        mock_sleep.assert_not_called()
+
+    def test_disabled(self):
+        """APIs with a rate of 0 aren't limited."""
+        for _ in range(5):
+            self.assertEqual(self.limiter.acquire("ssm", "get-parameters"), 0.0)
+        self.assertEqual(self.limiter.stats(), {})
+
+    def test_private_directory(self):
+        """The bucket directory is created accessible only by the current user."""
+        self.limiter.directory = os.path.join(self.limiter.directory, "buckets")
+        self.limiter.acquire("ssm", "describe-parameters")
+        self.assertEqual(os.stat(self.limiter.directory).st_mode & 0o777, 0o700)
+
+    @patch.dict(os.environ, AWS_SCRIPTS_RATE_LIMITS="ssm=1,ecs,ec2=fast")
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_from_environment_malformed(self, mock_stderr):
+        """Malformed rates are reported and ignored."""
+        limiter = RateLimiter.from_environment()
+        self.assertEqual(limiter.rates["ssm"], 1)
+        self.assertEqual(limiter.rates["ecs"], DEFAULT_RATE_LIMITS["ecs"])
+        self.assertEqual(limiter.rates["ec2"], DEFAULT_RATE_LIMITS["ec2"])
+        self.assertIn("Ignoring 'ecs'", mock_stderr.getvalue())
+        self.assertIn("Ignoring 'ec2=fast'", mock_stderr.getvalue())
+
+    @patch("sys.stderr", new_callable=StringIO)
+    def test_insecure_directory(self, mock_stderr):
+        """Limiting is disabled with a warning if the directory belongs to someone else."""
+        with patch("common.os.getuid", return_value=os.getuid() + 1):
+            self.assertEqual(self.limiter.acquire("ssm", "describe-parameters"), 0.0)
+        self.assertIn("Rate limiting disabled", mock_stderr.getvalue())
+        self.assertEqual(self.limiter.rates, {})
+
+    def test_shared(self):
+        """Limiters sharing a directory share buckets."""
+        other = RateLimiter(self.rates, self.limiter.directory)
+        with patch("common.sleep"), patch("common.time", return_value=100.0):
+            self.limiter.acquire("ssm", "describe-parameters")
+            self.limiter.acquire("ssm", "describe-parameters")
+            self.assertEqual(other.acquire("ssm", "describe-parameters"), 0.5)
+
+
+class TestTargets(TestCase):
+
+    def test_get_targets(self):
+        """A target is created for every combination of region and profile."""
+        targets = get_targets(regions=["r1", "r2"], profiles=["p1"])
+        self.assertEqual(
+            [(target.profile, target.region) for target in targets],
+            [("p1", "r1"), ("p1", "r2")]
+        )
+        self.assertEqual(get_targets()[0].labels, ("default", "default"))
+
+    def test_map_concurrently_target(self):
+        """Worker threads run against the caller's target."""
+        target = Target(region="foo")
+        with use_target(target):
+            targets = map_concurrently(lambda _: current_target(), range(4), max_workers=4)
+        self.assertEqual(targets, [target] * 4)
+        self.assertIsNone(current_target())
+
+    def test_map_targets_errors(self):
+        """A failing target doesn't prevent the others from completing."""
+        targets = get_targets(regions=["good", "bad"])
+
+        def func():
+            if current_target().region == "bad":
+                raise NonZeroErrorCode(255)
+            return current_target().region
+
+        results = map_targets(func, targets)
+        self.assertEqual([result for _, result, _ in results], ["good", None])
+        self.assertIsInstance(results[1][2], NonZeroErrorCode)
+
 
 class TestBasePaginatedCommand(TestCase):
 
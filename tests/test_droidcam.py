@@ -0,0 +1,201 @@
+import os
+import stat
+
+from io import BytesIO, TextIOWrapper
+from tempfile import TemporaryDirectory
+from time import monotonic
+from unittest import TestCase, skipUnless
+from unittest.mock import mock_open, patch
+
+from droidcam.droidcam_cli_with_tray_icon import (
+    DEFAULT_READY_PATTERN, DroidcamProcess, ProcessStats, Supervisor, get_exit_code,
+    get_icon_cache_path, get_icon_image
+)
+
+try:
+    import PIL
+except ImportError:
+    PIL = None
+
+
+class DroidcamTestCase(TestCase):
+    """Run a fake 'droidcam-cli', with its output echoed to a buffer rather than our own."""
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.command = os.path.join(directory.name, "droidcam-cli")
+        command = patch.object(DroidcamProcess, "command", self.command)
+        command.start()
+        self.addCleanup(command.stop)
+
+        self.stdout = TextIOWrapper(BytesIO())
+        stdout = patch("sys.stdout", self.stdout)
+        stdout.start()
+        self.addCleanup(stdout.stop)
+
+    def set_script(self, script):
+        with open(self.command, "w") as command_file:
+            command_file.write("#!/bin/sh\n" + script)
+        os.chmod(self.command, stat.S_IRWXU)
+
+    @property
+    def output(self):
+        return self.stdout.buffer.getvalue().decode()
+
+
+class TestDroidcamProcess(DroidcamTestCase):
+
+    def test_ready(self):
+        """Output is echoed until a line matches the ready pattern."""
+        self.set_script("echo starting; echo Connected; sleep 10")
+        process = DroidcamProcess([])
+        self.assertTrue(process.wait_until_ready(DEFAULT_READY_PATTERN, 5))
+        self.assertIsNone(process.returncode)
+        self.assertEqual(self.output, "starting\nConnected\n")
+        process.terminate()
+        self.assertEqual(process.wait(), -15)
+
+    def test_ready_pattern(self):
+        """The default pattern doesn't match lines saying droidcam-cli isn't connected."""
+        self.set_script("echo Not connected; echo Disconnected; echo Connected; sleep 10")
+        process = DroidcamProcess([])
+        self.assertTrue(process.wait_until_ready(DEFAULT_READY_PATTERN, 5))
+        self.assertEqual(self.output, "Not connected\nDisconnected\nConnected\n")
+        process.terminate()
+        process.wait()
+
+    def test_exit_before_ready(self):
+        """Waiting stops if the process exits, and everything it wrote is echoed."""
+        self.set_script('echo "failed: $1"; exit 3')
+        process = DroidcamProcess(["foo"])
+        self.assertFalse(process.wait_until_ready(DEFAULT_READY_PATTERN, 5))
+        self.assertEqual(process.wait(), 3)
+        self.assertEqual(self.output, "failed: foo\n")
+
+    def test_timeout(self):
+        """Waiting stops after the timeout, leaving the process running."""
+        self.set_script("sleep 10")
+        process = DroidcamProcess([])
+        self.assertFalse(process.wait_until_ready(DEFAULT_READY_PATTERN, 0.2))
+        self.assertIsNone(process.returncode)
+        process.terminate()
+        process.wait()
+
+    @skipUnless(hasattr(os, "pidfd_open"), "Requires pidfd_open")
+    def test_exit_with_output_held_open(self):
+        """The process's exit is seen even if a child still holds its output open."""
+        self.set_script("sleep 10 & exit 2")
+        started = monotonic()
+        process = DroidcamProcess([])
+        self.assertFalse(process.wait_until_ready(DEFAULT_READY_PATTERN, 5))
+        self.assertLess(monotonic() - started, 5)
+        self.assertEqual(process.returncode, 2)
+
+    def test_get_exit_code(self):
+        """Processes killed by a signal exit with 128 plus the signal number."""
+        self.assertEqual(get_exit_code(0), 0)
+        self.assertEqual(get_exit_code(3), 3)
+        self.assertEqual(get_exit_code(-15), 143)
+
+
+class TestSupervisor(DroidcamTestCase):
+
+    def test_run(self):
+        """The state changes as droidcam-cli connects and exits, and its return code is kept."""
+        self.set_script("echo Connected; exit 3")
+        states = []
+        supervisor = Supervisor([], on_change=lambda supervisor: states.append(supervisor.state))
+        supervisor.run()
+        self.assertEqual(states, [Supervisor.CONNECTING, Supervisor.LIVE, Supervisor.STOPPED])
+        self.assertEqual(supervisor.returncode, 3)
+        self.assertFalse(supervisor.timed_out)
+
+    def test_run_timed_out(self):
+        """droidcam-cli is stopped if it doesn't connect in time."""
+        self.set_script("sleep 10")
+        supervisor = Supervisor([], ready_timeout=0.2)
+        supervisor.run()
+        self.assertTrue(supervisor.timed_out)
+        self.assertEqual(supervisor.state, Supervisor.STOPPED)
+
+    def test_get_backoff(self):
+        """Backoffs double with each attempt, with jitter, up to the maximum."""
+        supervisor = Supervisor([], min_backoff=1, max_backoff=60)
+        for attempt, delay in ((0, 1), (3, 8), (10, 60)):
+            backoff = supervisor.get_backoff(attempt)
+            self.assertGreaterEqual(backoff, delay / 2)
+            self.assertLessEqual(backoff, delay)
+
+    def test_backoff_reset(self):
+        """The backoff is only reset once droidcam-cli has stayed connected for 'min_uptime'."""
+        supervisor = Supervisor([], restart=True, min_uptime=30)
+        uptimes = iter([None, None, 60.0, 5.0, None])
+
+        def run_once():
+            uptime = next(uptimes)
+            if uptime is None and supervisor.get_backoff.call_count == 4:
+                supervisor.stop()
+            return uptime
+
+        with patch.object(supervisor, "_run_once", side_effect=run_once), \
+                patch.object(supervisor, "get_backoff", return_value=0) as mock_get_backoff:
+            supervisor.run()
+        self.assertEqual(
+            [attempt for (attempt,), _ in mock_get_backoff.call_args_list], [0, 1, 0, 1]
+        )
+        self.assertEqual(supervisor.state, Supervisor.STOPPED)
+
+
+class TestProcessStats(TestCase):
+
+    def test_sample(self):
+        """Fields following the command name, which may contain spaces, are parsed."""
+        fields = ["0"] * 40
+        fields[11] = str(2 * ProcessStats.clock_ticks)
+        fields[12] = str(ProcessStats.clock_ticks)
+        fields[17] = "4"
+        fields[21] = "10"
+        contents = "123 (droid cam) x) " + " ".join(fields)
+        stats = ProcessStats()
+        with patch("builtins.open", mock_open(read_data=contents)) as mock_file:
+            sample = stats.sample(123)
+        mock_file.assert_called_once_with("/proc/123/stat")
+        self.assertEqual(sample["cpu_seconds"], 3.0)
+        self.assertIsNone(sample["cpu_percent"])
+        self.assertEqual(sample["threads"], 4)
+        self.assertEqual(sample["rss_bytes"], 10 * ProcessStats.page_size)
+        self.assertEqual(stats.describe(), "CPU -, RSS {:.1f} MiB, 4 threads".format(
+            10 * ProcessStats.page_size / 2 ** 20
+        ))
+
+    def test_sample_self(self):
+        """Our own process can be sampled, with CPU usage from the second sample on."""
+        stats = ProcessStats()
+        first = stats.sample(os.getpid())
+        self.assertGreater(first["rss_bytes"], 0)
+        self.assertGreaterEqual(first["threads"], 1)
+        second = stats.sample(os.getpid())
+        self.assertGreaterEqual(second["cpu_percent"], 0)
+
+
+@skipUnless(PIL, "Requires Pillow")
+class TestIconImage(TestCase):
+
+    def setUp(self):
+        cache_dir = TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        environ = patch.dict(os.environ, XDG_CACHE_HOME=cache_dir.name)
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_cache(self):
+        """The decoded icon is cached and loaded from the cache afterwards."""
+        from PIL import Image
+
+        image = get_icon_image()
+        self.assertTrue(os.path.exists(get_icon_cache_path()))
+        with patch.object(Image, "open", side_effect=AssertionError("Icon decoded again")):
+            cached = get_icon_image()
+        self.assertEqual(cached.size, image.size)
+        self.assertEqual(cached.tobytes(), image.tobytes())
@@ -0,0 +1,84 @@
+import os
+import shutil
+import subprocess
+
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+from aws.ecs_completion import (
+    complete, get_completion_script, get_index_path, main, match_names, read_index, write_index
+)
+
+
+class TestMatchNames(TestCase):
+
+    def test_match_names(self):
+        """Names beginning with the word come before names otherwise containing it."""
+        arns = ["arn/foo_bar", "arn/bar", "arn/barfoo", "arn/baz"]
+        self.assertEqual(match_names("bar", arns), ["bar", "barfoo", "foo_bar"])
+        self.assertEqual(match_names("", arns), ["foo_bar", "bar", "barfoo", "baz"])
+
+
+class TestComplete(TestCase):
+
+    index = {
+        "updated": 0,
+        "clusters": {
+            "arn/cluster_a": ["arn/service_a", "arn/service_b"],
+            "arn/cluster_b": ["arn/service_c"],
+        }
+    }
+
+    def test_clusters(self):
+        self.assertEqual(complete(self.index, "clusters", "cl"), ["cluster_a", "cluster_b"])
+
+    def test_services(self):
+        """Services are completed for the single cluster matching the cluster name."""
+        self.assertEqual(
+            complete(self.index, "services", "", "_a"), ["service_a", "service_b"]
+        )
+        self.assertEqual(complete(self.index, "services", "", "cluster"), [])
+
+    @patch("aws.ecs_completion.refresh_in_background")
+    def test_main_stale_index(self, mock_refresh):
+        """A stale index is still used, while a refresh is started in the background."""
+        with TemporaryDirectory() as cache_dir, patch.dict(os.environ, XDG_CACHE_HOME=cache_dir):
+            self.assertEqual(main("clusters", "cluster_b"), [])
+            self.assertEqual(mock_refresh.call_count, 1)
+
+            write_index(get_index_path(), self.index["clusters"])
+            self.assertEqual(read_index(get_index_path())["clusters"], self.index["clusters"])
+            self.assertEqual(main("clusters", "cluster_b"), ["cluster_b"])
+            self.assertEqual(mock_refresh.call_count, 1)
+
+            self.assertEqual(main("clusters", "cluster_b", max_age=-1), ["cluster_b"])
+            self.assertEqual(mock_refresh.call_count, 2)
+
+
+@skipUnless(shutil.which("bash"), "Requires bash")
+class TestBashScript(TestCase):
+
+    def _complete(self, line):
+        """Complete the last word of 'line', echoing the arguments completion is run with."""
+        script = get_completion_script("bash", python="echo", script="ecs_completion.py")
+        command = 'read -ra COMP_WORDS <<< "$1"; COMP_CWORD=$((${#COMP_WORDS[@]} - 1)); ' \
+                  '_get_ecs_url; echo "${COMPREPLY[*]}"'
+        return subprocess.check_output(
+            ["bash", "-c", script + command, "bash", line], universal_newlines=True
+        ).strip()
+
+    def test_positional_words(self):
+        """Options and their values aren't counted as cluster or service names."""
+        self.assertEqual(self._complete("get_ecs_url --ssh cl"),
+                         "ecs_completion.py complete clusters cl")
+        self.assertEqual(self._complete("get_ecs_url --prefer-az eu-west-1a cluster se"),
+                         "ecs_completion.py complete services se cluster")
+        self.assertEqual(self._complete("get_ecs_url --prefer-az = eu-west-1a cluster se"),
+                         "ecs_completion.py complete services se cluster")
+
+    def test_no_completion(self):
+        """Nothing is completed for options, option values or words after the service."""
+        for line in ("get_ecs_url --prefer-az eu", "get_ecs_url cluster --ss",
+                     "get_ecs_url cluster service x"):
+            self.assertEqual(self._complete(line), "")
@@ -1,9 +1,13 @@
+import threading
+
+from time import sleep
 from unittest import TestCase
 from unittest.mock import patch, call
 
 from tests.test_common import patch_command
 from aws.fetch_params import (
-    grouper, DescribeParameters, GetParameters, CompileParameters, NoParametersFound
+    grouper, collapse_prefixes, DescribeParameters, GetParameters, CompileParameters,
+    LazyParameters, NoParametersFound, Parameter
 )
 
 
@@ -22,6 +26,16 @@ class TestGrouper(TestCase):
         )
 
 
+class TestCollapsePrefixes(TestCase):
+
+    def test_collapse_prefixes(self):
+        """Duplicate prefixes and those covered by a shorter prefix are removed."""
+        self.assertListEqual(
+            collapse_prefixes(["/app/prod/worker/", "/shared/", "/app/prod/", "/shared/"]),
+            ["/app/prod/", "/shared/"]
+        )
+
+
 class TestDescribeParameters(TestCase):
 
     name_prefix = "foo"
@@ -32,7 +46,26 @@ class TestDescribeParameters(TestCase):
         command = DescribeParameters(self.name_prefix)
         self.assertEqual(
             command.call_args,
-            [*command.base_command.split(" "), command.filters_arg, "Key=Name,Values=foo"]
+            [
+                *command.base_command.split(" "),
+                command.filters_arg,
+                "Key=Name,Values=foo",
+                command.page_size_arg,
+                "50"
+            ]
+        )
+
+    def test_call_args_single_page(self):
+        """A paging argument is passed so the CLI only fetches the first page."""
+        command = DescribeParameters(self.name_prefix, single_page=True)
+        self.assertEqual(command.call_args[-2:], [command.max_results_arg, "50"])
+
+    def test_call_args_exact(self):
+        """An exact match uses an 'Equals' parameter filter."""
+        command = DescribeParameters(self.name_prefix, exact=True)
+        self.assertEqual(
+            command.call_args[3:5],
+            [command.exact_filters_arg, "Key=Name,Option=Equals,Values=foo"]
         )
 
     def test_call_args_next(self):
@@ -45,7 +78,9 @@ class TestDescribeParameters(TestCase):
                 command.filters_arg,
                 "Key=Name,Values=foo",
                 command.next_arg,
-                self.next_token
+                self.next_token,
+                command.max_results_arg,
+                "50"
             ]
         )
 
@@ -125,7 +160,7 @@ class TestCompileParameters(TestCase):
         """Calling '_get_names' fetches parameter names as expected."""
         names = CompileParameters(self.name_prefix)._get_names()
         self.assertEqual(names, [self.names[0]])
-        mock_command_init.assert_called_once_with(self.name_prefix)
+        mock_command_init.assert_called_once_with(self.name_prefix, None, exact=False)
         mock_command_call.assert_called_once_with()
 
     @patch_command(DescribeParameters, [_get_describe_parameters_response([names[0]], next_token),
@@ -136,7 +171,10 @@ class TestCompileParameters(TestCase):
         self.assertEqual(names, [self.names[0], "foo_bang"])
         self.assertEqual(
             mock_command_init.call_args_list,
-            [call(self.name_prefix), call(self.name_prefix, self.next_token)]
+            [
+                call(self.name_prefix, None, exact=False),
+                call(self.name_prefix, self.next_token, exact=False)
+            ]
         )
         self.assertEqual(
             mock_command_call.call_args_list,
@@ -162,3 +200,148 @@ class TestCompileParameters(TestCase):
         self.assertEqual(parameters, mock_get_values.return_value)
         mock_get_names.assert_called_once_with()
         mock_get_values.assert_called_once_with(self.names)
+
+    @patch_command(DescribeParameters, _get_describe_parameters_response([names[0]]))
+    def test_get_names_partitions_single_page(self, mock_command_init, mock_command_call):
+        """Partitioning is skipped if the first page is the only one."""
+        names = CompileParameters(self.name_prefix, partitions=["_"])._get_names()
+        self.assertEqual(names, [self.names[0]])
+        mock_command_init.assert_called_once_with(self.name_prefix, single_page=True)
+
+    def test_get_names_partitions(self):
+        """Partitions and the exact prefix are enumerated separately and duplicates removed."""
+        responses = {
+            (self.name_prefix, None, True, False): _get_describe_parameters_response(
+                [self.names[0]], self.next_token
+            ),
+            ("foo_b", None, False, False): _get_describe_parameters_response(
+                [self.names[0]], self.next_token
+            ),
+            ("foo_b", self.next_token, False, False): _get_describe_parameters_response(
+                [self.names[1]]
+            ),
+            ("foo_c", None, False, False): _get_describe_parameters_response([]),
+            (self.name_prefix, None, False, True): _get_describe_parameters_response(["foo"]),
+        }
+
+        def describe(command):
+            return responses[
+                (command.name_prefix, command.next_token, command.single_page, command.exact)
+            ]
+
+        with patch.object(DescribeParameters, "__call__", autospec=True, side_effect=describe):
+            names = CompileParameters(self.name_prefix, partitions=["_b", "_c"])._get_names()
+        self.assertEqual(names, [*self.names, "foo"])
+
+    def test_get_names_multiple_prefixes(self):
+        """Names from several prefixes are merged and de-duplicated."""
+        responses = {
+            "foo": _get_describe_parameters_response(self.names),
+            "bar": _get_describe_parameters_response(["bar_a", self.names[0]]),
+        }
+
+        def describe(command):
+            return responses[command.name_prefix]
+
+        with patch.object(DescribeParameters, "__call__", autospec=True, side_effect=describe):
+            names = CompileParameters(["foo", "bar", "foo_b"])._get_names()
+        self.assertCountEqual(names, [*self.names, "bar_a"])
+
+    def test_get_values_batches(self):
+        """Names are fetched in batches of at most 'GetParameters.max_length'."""
+        names = ["foo_{}".format(index) for index in range(GetParameters.max_length + 1)]
+
+        def get(command):
+            return _get_get_parameters_response({name: 0 for name in command.names})
+
+        with patch.object(GetParameters, "__call__", autospec=True, side_effect=get):
+            parameters = CompileParameters(self.name_prefix)._get_values(names)
+        self.assertEqual([parameter["Name"] for parameter in parameters], names)
+
+    def test_group_by_prefix(self):
+        """Parameters are grouped under every prefix they match."""
+        parameters = [{"Name": "foo_bar"}, {"Name": "foo_bang"}, {"Name": "bar"}]
+        grouped = CompileParameters(["foo", "foo_ba", "bar"]).group_by_prefix(parameters)
+        self.assertEqual(grouped, {
+            "foo": parameters[:2],
+            "foo_ba": parameters[:2],
+            "bar": parameters[2:],
+        })
+
+    @patch_command(DescribeParameters, _get_describe_parameters_response(names))
+    def test_names(self, _, __):
+        """Calling 'names' returns matching names without fetching values."""
+        with patch.object(GetParameters, "__call__") as mock_get_parameters:
+            names = CompileParameters(self.name_prefix).names()
+        self.assertEqual(names, self.names)
+        mock_get_parameters.assert_not_called()
+
+    @patch_command(DescribeParameters, _get_describe_parameters_response(names))
+    def test_metadata(self, _, __):
+        """Calling 'metadata' returns describe records without fetching values."""
+        with patch.object(GetParameters, "__call__") as mock_get_parameters:
+            metadata = CompileParameters(self.name_prefix).metadata()
+        self.assertEqual(metadata, [{"Name": name} for name in self.names])
+        mock_get_parameters.assert_not_called()
+
+
+class TestLazyParameters(TestCase):
+
+    names = ["foo_{}".format(index) for index in range(GetParameters.max_length + 1)]
+
+    def _get_lazy_parameters(self):
+        return LazyParameters([Parameter(name, "SecureString") for name in self.names])
+
+    @staticmethod
+    def _get(command):
+        return _get_get_parameters_response({name: name.upper() for name in command.names})
+
+    def test_value_fetches_batch(self):
+        """Accessing a value fetches only the batch containing that parameter."""
+        parameters = self._get_lazy_parameters()
+        with patch.object(
+            GetParameters, "__call__", autospec=True, side_effect=self._get
+        ) as mock_call:
+            self.assertEqual(parameters[0].value, "FOO_0")
+            self.assertEqual(parameters[1].value, "FOO_1")
+            self.assertEqual(mock_call.call_count, 1)
+            self.assertEqual(parameters[-1].value, "FOO_10")
+            self.assertEqual(mock_call.call_count, 2)
+
+    def test_concurrent_access(self):
+        """A batch accessed from several threads at once is only fetched once."""
+        parameters = self._get_lazy_parameters()
+
+        def get(command):
+            sleep(0.1)
+            return self._get(command)
+
+        with patch.object(
+            GetParameters, "__call__", autospec=True, side_effect=get
+        ) as mock_call:
+            threads = [
+                threading.Thread(target=lambda index=index: parameters[index].value)
+                for index in range(GetParameters.max_length)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mock_call.call_count, 1)
+        self.assertEqual(parameters[1].value, "FOO_1")
+
+    def test_to_list(self):
+        """Calling 'to_list' fetches every batch once."""
+        parameters = self._get_lazy_parameters()
+        with patch.object(
+            GetParameters, "__call__", autospec=True, side_effect=self._get
+        ) as mock_call:
+            results = parameters.to_list()
+            parameters.to_list()
+        self.assertEqual(mock_call.call_count, 2)
+        self.assertEqual([result["Value"] for result in results],
+                         [name.upper() for name in self.names])
+
+    def test_slots(self):
+        """Parameters don't carry a per-instance '__dict__'."""
+        self.assertFalse(hasattr(Parameter("foo", "String"), "__dict__"))
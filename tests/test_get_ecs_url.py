@@ -1,11 +1,15 @@
+import os
+
+from tempfile import TemporaryDirectory
 from unittest import TestCase
-from unittest.mock import call
+from unittest.mock import call, patch
 
 from tests.test_common import patch_run
 
 from aws.get_ecs_url import (
     NoResourceFound, ListClusters, ListServices, ListTasks, DescribeTasks,
-    DescribeContainerInstances, DescribeEc2Instances, match_arn
+    DescribeContainerInstances, DescribeEc2Instances, ServiceWatcher, detect_availability_zone,
+    get_hosts, get_ssh_args, main, match_arn, run_each
 )
 
 
@@ -108,3 +112,200 @@ class TestMatchArn(TestCase):
 
         with self.assertRaisesRegex(NoResourceFound, "No resource matching"):
             match_arn("hhhhawhs", arns)
+
+
+class EcsTestCase(TestCase):
+    """Emulates a service whose tasks are listed in 'task_arns'.
+
+    Each task runs on its own container instance and EC2 instance, in the availability zone given
+    by 'zones' or 'zone-a'.
+    """
+
+    def setUp(self):
+        self.task_arns = ["task_a"]
+        self.zones = {}
+        self.calls = []
+
+        def list_tasks(command):
+            self.calls.append("list-tasks")
+            return {"taskArns": list(self.task_arns)}
+
+        def describe_tasks(command):
+            self.calls.append(("describe-tasks", command.task_arns))
+            return {"tasks": [
+                {"taskArn": arn, "containerInstanceArn": "container_" + arn}
+                for arn in command.task_arns
+            ]}
+
+        def describe_containers(command):
+            self.calls.append("describe-container-instances")
+            return {"containerInstances": [
+                {"containerInstanceArn": arn, "ec2InstanceId": "i-" + arn}
+                for arn in command.container_arns
+            ]}
+
+        def describe_instances(command):
+            self.calls.append("describe-instances")
+            return {"Reservations": [{"Instances": [
+                {
+                    "InstanceId": instance_id,
+                    "PrivateDnsName": instance_id + ".internal",
+                    "Placement": {"AvailabilityZone": self.zones.get(instance_id, "zone-a")},
+                }
+                for instance_id in command.instance_ids
+            ]}]}
+
+        for command_class, side_effect in (
+            (ListTasks, list_tasks),
+            (DescribeTasks, describe_tasks),
+            (DescribeContainerInstances, describe_containers),
+            (DescribeEc2Instances, describe_instances),
+        ):
+            patcher = patch.object(
+                command_class, "__call__", autospec=True, side_effect=side_effect
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestServiceWatcher(EcsTestCase):
+
+    def test_unchanged_poll(self):
+        """Polling an unchanged service costs a single 'list-tasks' call."""
+        watcher = ServiceWatcher("cluster", "service")
+        self.assertTrue(watcher.poll())
+        self.assertEqual(watcher.hosts, {"i-container_task_a.internal"})
+
+        self.calls.clear()
+        self.assertFalse(watcher.poll())
+        self.assertEqual(self.calls, ["list-tasks"])
+
+    def test_new_task(self):
+        """Only tasks which haven't been seen before are described."""
+        watcher = ServiceWatcher("cluster", "service")
+        watcher.poll()
+
+        self.calls.clear()
+        self.task_arns[:] = ["task_a", "task_b"]
+        self.assertTrue(watcher.poll())
+        self.assertIn(("describe-tasks", ["task_b"]), self.calls)
+        self.assertEqual(
+            watcher.hosts, {"i-container_task_a.internal", "i-container_task_b.internal"}
+        )
+
+        self.calls.clear()
+        self.task_arns[:] = ["task_b"]
+        self.assertTrue(watcher.poll())
+        self.assertEqual(self.calls, ["list-tasks"])
+        self.assertEqual(watcher.hosts, {"i-container_task_b.internal"})
+
+
+class TestGetHosts(EcsTestCase):
+
+    @patch("aws.get_ecs_url.resolve_service", return_value=("cluster", "service"))
+    def test_get_hosts(self, _):
+        """Every task's host is returned, describing all tasks at once."""
+        self.task_arns[:] = ["task_a", "task_b"]
+        self.assertEqual(
+            get_hosts("cluster", "service"),
+            ["i-container_task_a.internal", "i-container_task_b.internal"]
+        )
+        self.assertEqual(self.calls[1], ("describe-tasks", ["task_a", "task_b"]))
+
+    @patch("aws.get_ecs_url.resolve_service", return_value=("cluster", "service"))
+    def test_many_tasks(self, _):
+        """Tasks and container instances are described a hundred at a time."""
+        self.task_arns[:] = ["task_{}".format(index) for index in range(150)]
+        hosts = get_hosts("cluster", "service")
+        self.assertEqual(hosts[-1], "i-container_task_149.internal")
+        self.assertEqual(len(hosts), 150)
+        self.assertEqual(
+            [len(entry[1]) for entry in self.calls if entry[0] == "describe-tasks"], [100, 50]
+        )
+        self.assertEqual(self.calls.count("describe-container-instances"), 2)
+
+    @patch("aws.get_ecs_url.resolve_service", return_value=("cluster", "service"))
+    def test_no_tasks(self, _):
+        self.task_arns[:] = []
+        with self.assertRaisesRegex(NoResourceFound, "No running tasks"):
+            get_hosts("cluster", "service")
+
+
+class TestSsh(TestCase):
+
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = patch("aws.get_ecs_url.SSH_CONTROL_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.control_dir = directory.name
+
+    def test_ssh_args(self):
+        """Connections to each host are shared through a control socket."""
+        self.assertEqual(
+            get_ssh_args("foo.internal", "uptime", control_persist="5m"),
+            [
+                "ssh",
+                "-o", "ControlMaster=auto",
+                "-o", "ControlPath={}/%C".format(self.control_dir),
+                "-o", "ControlPersist=5m",
+                "foo.internal", "uptime",
+            ]
+        )
+
+    def test_run_each(self):
+        """Each host's output is prefixed with its name and the highest exit status returned."""
+        def get_args(host, command, control_persist, batch):
+            self.assertTrue(batch)
+            return ["sh", "-c", "echo one; echo two; exit {}".format(1 if host == "b" else 0)]
+
+        lines = []
+        with patch("aws.get_ecs_url.get_ssh_args", side_effect=get_args):
+            status = run_each(["a", "b"], "uptime", output=lines.append)
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted(lines), ["a: one", "a: two", "b: one", "b: two"])
+
+    def test_run_each_killed(self):
+        """A host whose SSH process is killed by a signal isn't outranked by a clean exit."""
+        def get_args(host, command, control_persist, batch):
+            return ["sh", "-c", "kill -TERM $$" if host == "b" else "exit 0"]
+
+        with patch("aws.get_ecs_url.get_ssh_args", side_effect=get_args):
+            status = run_each(["a", "b"], "uptime", output=print)
+        self.assertEqual(status, 143)
+
+
+class TestPreferAz(EcsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.task_arns[:] = ["task_a", "task_b"]
+        self.zones["i-container_task_b"] = "zone-b"
+        patcher = patch(
+            "aws.get_ecs_url.resolve_service", return_value=("cluster", "service")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_no_preference(self):
+        """Without a preference, only the first task is described."""
+        self.assertEqual(main("cluster", "service"), "i-container_task_a.internal")
+        self.assertIn(("describe-tasks", ["task_a"]), self.calls)
+
+    def test_prefer_az(self):
+        """An instance in the preferred zone is chosen without any further calls."""
+        self.assertEqual(main("cluster", "service", "zone-b"), "i-container_task_b.internal")
+        self.assertEqual(len(self.calls), 4)
+
+    def test_fallback(self):
+        """The first instance is chosen if none are in the preferred zone."""
+        self.assertEqual(main("cluster", "service", "zone-c"), "i-container_task_a.internal")
+
+    def test_detect_from_file(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, "az")
+            with open(path, "w") as az_file:
+                az_file.write("zone-b\n")
+            self.assertEqual(detect_availability_zone(path), "zone-b")
+            self.assertIsNone(detect_availability_zone(os.path.join(directory, "missing")))
@@ -0,0 +1,103 @@
+import os
+import threading
+
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from common import BaseCommand, NonZeroErrorCode, current_target
+from aws.helper_daemon import (
+    COMMANDS, DaemonError, DaemonUnavailable, HelperServer, _send, clear_cache,
+    get_credential_variables, get_socket_path, request
+)
+
+
+class TestHelperServer(TestCase):
+
+    def setUp(self):
+        runtime_dir = TemporaryDirectory()
+        self.addCleanup(runtime_dir.cleanup)
+        environ = patch.dict(
+            os.environ, XDG_RUNTIME_DIR=runtime_dir.name, AWS_PROFILE="foo", AWS_REGION="bar"
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        for variable in (*get_credential_variables(), "AWS_SCRIPTS_NO_DAEMON"):
+            os.environ.pop(variable, None)
+
+        def echo(**kwargs):
+            target = current_target()
+            return [target.profile, target.region, kwargs]
+
+        def fail():
+            raise NonZeroErrorCode(255)
+
+        commands = patch.dict(COMMANDS, echo=echo, fail=fail)
+        commands.start()
+        self.addCleanup(commands.stop)
+
+    def _start_server(self):
+        server = HelperServer(get_socket_path())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            BaseCommand.cache = None
+
+        self.addCleanup(stop)
+        return server
+
+    def test_unavailable(self):
+        """Requests raise an error if the helper isn't running."""
+        with self.assertRaises(DaemonUnavailable):
+            request("echo")
+
+    def test_bypassed(self):
+        """Requests aren't sent if credentials are set in the environment."""
+        self._start_server()
+        for variable in ("AWS_ACCESS_KEY_ID", "AWS_CONFIG_FILE", "AWS_ENDPOINT_URL_SSM",
+                         "AWS_CONTAINER_CREDENTIALS_FULL_URI", "HTTPS_PROXY"):
+            with patch.dict(os.environ, {variable: "foo"}), \
+                    self.assertRaises(DaemonUnavailable):
+                request("echo")
+
+    def test_no_response(self):
+        """A request the helper doesn't answer in time raises an error rather than being rerun."""
+        answer = threading.Event()
+        self._start_server()
+        self.addCleanup(answer.set)
+        with patch.dict(COMMANDS, slow=answer.wait), \
+                self.assertRaisesRegex(DaemonError, "No response"):
+            _send({"command": "slow", "kwargs": {}, "profile": None, "region": None}, timeout=0.2)
+
+    def test_shared_directory(self):
+        """Clients refuse a socket directory others can access."""
+        self._start_server()
+        os.chmod(os.environ["XDG_RUNTIME_DIR"], 0o755)
+        with self.assertRaises(DaemonUnavailable):
+            request("echo")
+
+    def test_clear_cache(self):
+        """'clear_cache' empties the helper's cache, and does nothing if it isn't running."""
+        clear_cache()
+        server = self._start_server()
+        server.cache.set(["foo"], "{}", 60)
+        clear_cache()
+        self.assertEqual(server.cache.stats()["entries"], 0)
+
+    def test_request(self):
+        """Commands are run against the client's profile and region."""
+        server = self._start_server()
+        self.assertEqual(request("echo", a=1), ["foo", "bar", {"a": 1}])
+        self.assertEqual(server.stats()["requests"], 1)
+
+    def test_errors(self):
+        """Errors raised by commands are re-raised by the client."""
+        self._start_server()
+        with self.assertRaisesRegex(NonZeroErrorCode, "255"):
+            request("fail", (NonZeroErrorCode,))
+        with self.assertRaisesRegex(DaemonError, "NonZeroErrorCode"):
+            request("fail")
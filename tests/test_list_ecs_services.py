@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import patch, call
+
+from tests.test_common import patch_run
+
+from aws.list_ecs_services import (
+    DescribeServices, get_deployment_state, get_service_statuses
+)
+
+
+class TestDescribeServices(TestCase):
+
+    @patch_run()
+    def test_call_args(self, mock_run):
+        DescribeServices(cluster_arn="foo", service_arns=["bar", "baz"])()
+
+        expected_call_args = [
+            "aws", "ecs", "describe-services", "--cluster", "foo", "--services", "bar", "baz"
+        ]
+
+        self.assertEqual(
+            mock_run.call_args_list,
+            [call(expected_call_args, stdout=-1)]
+        )
+
+    def test_too_many_services_error(self):
+        """Initialising command with too many services raises an error."""
+        self.assertRaisesRegex(
+            AssertionError,
+            "Can't describe more than 10 services at once",
+            DescribeServices,
+            "foo",
+            ["bar"] * (DescribeServices.max_length + 1)
+        )
+
+
+class TestGetServiceStatuses(TestCase):
+
+    def test_deployment_state(self):
+        """The primary deployment's rollout state is used where available."""
+        self.assertEqual(get_deployment_state({"deployments": [
+            {"status": "ACTIVE", "rolloutState": "COMPLETED"},
+            {"status": "PRIMARY", "rolloutState": "IN_PROGRESS"},
+        ]}), "IN_PROGRESS")
+        self.assertEqual(get_deployment_state({"deployments": [{"status": "PRIMARY"}]}), "STEADY")
+        self.assertEqual(
+            get_deployment_state({"deployments": [{"status": "PRIMARY"}, {"status": "ACTIVE"}]}),
+            "DEPLOYING"
+        )
+
+    def test_batches(self):
+        """Services are described in batches of at most 'DescribeServices.max_length'."""
+        service_arns = ["service_{}".format(index) for index in range(15)]
+
+        def describe(command):
+            return {"services": [
+                {"serviceArn": arn, "runningCount": 1, "desiredCount": 2, "deployments": []}
+                for arn in command.service_arns
+            ]}
+
+        with patch.object(
+            DescribeServices, "__call__", autospec=True, side_effect=describe
+        ) as mock_call:
+            statuses = get_service_statuses("foo", service_arns)
+
+        self.assertEqual(mock_call.call_count, 2)
+        self.assertEqual(statuses, {arn: "1/2 STEADY" for arn in service_arns})
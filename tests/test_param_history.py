@@ -0,0 +1,87 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from aws.param_history import (
+    CompileHistory, CompileParameters, GetParameterHistory, hash_value, parse_timestamp
+)
+
+
+class TestGetParameterHistory(TestCase):
+
+    def test_call_args(self):
+        """Call args are formatted as expected."""
+        command = GetParameterHistory("foo", "next", with_decryption=True)
+        self.assertEqual(
+            command.call_args,
+            [
+                *command.base_command.split(" "),
+                command.name_arg, "foo",
+                command.decryption_arg,
+                command.next_arg, "next"
+            ]
+        )
+
+
+class TestParseTimestamp(TestCase):
+
+    def test_formats(self):
+        """Timestamps from both CLI versions and users are parsed."""
+        self.assertEqual(parse_timestamp(86400.5), 86400.5)
+        self.assertEqual(parse_timestamp("1970-01-02"), 86400)
+        self.assertEqual(parse_timestamp("1970-01-02T01:00:00+01:00"), 86400)
+        self.assertEqual(parse_timestamp("1970-01-02T00:00:00.500000+00:00"), 86400.5)
+        self.assertEqual(parse_timestamp("1970-01-02T00:00:00Z"), 86400)
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Unrecognised timestamp"):
+            parse_timestamp("yesterday")
+        # Too short to end in a UTC offset, so left as given
+        with self.assertRaisesRegex(ValueError, "Unrecognised timestamp: 10:00$"):
+            parse_timestamp("10:00")
+
+
+class TestCompileHistory(TestCase):
+
+    history = {
+        ("foo_a", None): {
+            "Parameters": [{"Name": "foo_a", "Version": 1, "LastModifiedDate": 10,
+                            "Type": "String", "Value": "1"}],
+            "NextToken": "next",
+        },
+        ("foo_a", "next"): {
+            "Parameters": [{"Name": "foo_a", "Version": 2, "LastModifiedDate": 30,
+                            "Type": "String", "Value": "2"}],
+        },
+        ("foo_b", None): {
+            "Parameters": [{"Name": "foo_b", "Version": 1, "LastModifiedDate": 20,
+                            "Type": "SecureString", "Value": "secret"}],
+        },
+    }
+
+    def _compile(self, **kwargs):
+        def get_history(command):
+            return self.history[(command.name, command.next_token)]
+
+        with patch.object(CompileParameters, "names", return_value=["foo_a", "foo_b"]), \
+                patch.object(GetParameterHistory, "__call__", autospec=True,
+                             side_effect=get_history):
+            return list(CompileHistory(["foo"], **kwargs)())
+
+    def test_ordered(self):
+        """Versions of every parameter are merged in order of modification time."""
+        versions = self._compile()
+        self.assertEqual(
+            [(version["Name"], version["Version"]) for version in versions],
+            [("foo_a", 1), ("foo_b", 1), ("foo_a", 2)]
+        )
+        self.assertEqual(versions[1]["Value"], "secret")
+
+    def test_since(self):
+        versions = self._compile(since=20)
+        self.assertEqual([version["LastModifiedDate"] for version in versions], [20, 30])
+
+    def test_hash_secure_strings(self):
+        """SecureString values are replaced with their hash."""
+        versions = self._compile(hash_secure_strings=True)
+        self.assertEqual(versions[0]["Value"], "1")
+        self.assertEqual(versions[1]["Value"], hash_value("secret"))
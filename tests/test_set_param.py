@@ -5,6 +5,7 @@ from functools import wraps
 from unittest import TestCase
 from unittest.mock import patch
 
+from common import RateLimiter
 from aws.set_param import PutParameter, run_commands
 
 
@@ -45,13 +46,15 @@ class TestPutParameter(TestCase):
             ]
         )
 
+    @patch.object(RateLimiter, "acquire", return_value=0.0)
     @patch("aws.set_param.call")
-    def test_call(self, mock_call):
-        """Calling the command calls 'subprocess.call' with correct args."""
+    def test_call(self, mock_call, mock_acquire):
+        """Calling the command takes a rate limit token and calls 'subprocess.call'."""
         command = PutParameter(self.parameter_name, self.parameter_value)
         args = command.call_args
         command()
         mock_call.assert_called_once_with(args)
+        mock_acquire.assert_called_once_with("ssm", "put-parameter")
 
     def test_from_dict(self):
         """A 'PutParameter' object is created from a correctly formatted JSON input."""
@@ -114,6 +117,18 @@ class TestRunCommands(TestCase):
             input_json
         )
 
+    @patch("aws.set_param.clear_cache")
+    @patch.object(PutParameter, "__call__")
+    def test_clears_helper_cache(self, mock_call, mock_clear_cache):
+        """The helper's cache is only cleared if a parameter was changed."""
+        parameter_args = ("foo", "bar", PutParameter.ParameterTypes.STRING, True)
+        mock_call.return_value = 1
+        run_commands(*parameter_args)
+        mock_clear_cache.assert_not_called()
+        mock_call.return_value = 0
+        run_commands(*parameter_args)
+        mock_clear_cache.assert_called_once_with()
+
     @patch_command
     def test_json_single_parameter(self, mock_call, mock_init):
         """JSON input with a single valid parameter results in a single call."""